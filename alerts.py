@@ -0,0 +1,172 @@
+# 告警分发：监控只负责把告警放入队列，由后台线程分发到各个通道 (控制台/提示音/日志文件/webhook)
+#
+# 每个通道有独立的有界队列和线程，某个通道变慢或阻塞时只会丢弃该通道的告警，不影响监控和其他通道
+
+import json
+import time
+import queue
+import threading
+import pygame
+import requests
+
+import utils
+
+
+class Alert:
+    """一条告警"""
+
+    __slots__ = ("tic", "symbol", "price", "rule", "alarm", "message", "color", "sound", "created")
+
+    def __init__(self, tic, symbol, price, rule, alarm, message, color=None, sound=1):
+        self.tic = tic    # K线开盘时间戳 (毫秒)
+        self.symbol = symbol
+        self.price = price
+        self.rule = rule    # 规则名称
+        self.alarm = alarm    # 提示类别 (1: 上涨, -1: 下跌)
+        self.message = message
+        self.color = color
+        self.sound = sound    # 提示音播放次数
+        self.created = time.time()    # 检测到告警的时间
+
+    def text(self, color=True):
+        text = "%s >>> %s, $%s, %s" % (
+            utils.tic2time(self.tic),
+            self.symbol,
+            utils.standardize(self.price),
+            self.message,
+        )
+        if color and self.color == "red":
+            text = "\033[1;31m%s\033[0m" % text    # 显示红色字体
+        return text
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Sink:
+    """告警通道基类"""
+
+    name = "sink"
+
+    def emit(self, alert):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ConsoleSink(Sink):
+    name = "console"
+
+    def emit(self, alert):
+        print(alert.text())
+
+
+class SoundSink(Sink):
+    """播放提示音 (需已调用`pygame.mixer.init()`并加载音频)"""
+
+    name = "sound"
+
+    def emit(self, alert):
+        for i in range(alert.sound):
+            pygame.mixer.music.play()    # 播放提示音
+            if i < alert.sound - 1:
+                time.sleep(0.5)
+
+
+class JsonlSink(Sink):
+    """追加写入告警日志，每行一条JSON"""
+
+    name = "jsonl"
+
+    def __init__(self, file):
+        self.f = open(file, "a", encoding="utf-8")
+
+    def emit(self, alert):
+        self.f.write("%s\n" % json.dumps(alert.to_dict(), ensure_ascii=False))
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class WebhookSink(Sink):
+    """以JSON POST告警到指定地址"""
+
+    name = "webhook"
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def emit(self, alert):
+        data = alert.to_dict()
+        data["text"] = alert.text(color=False)
+        response = self.session.post(self.url, json=data, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class AlertDispatcher:
+    """告警分发器
+
+    sinks: 通道列表
+    maxsize: 每个通道的队列长度，队列满时丢弃新告警并计数
+    """
+
+    def __init__(self, sinks, maxsize=1000):
+        self.sinks = list(sinks)
+        self.queues = [queue.Queue(maxsize) for _ in self.sinks]
+        self.counters = [{"sent": 0, "dropped": 0, "failed": 0} for _ in self.sinks]
+        self.threads = []
+        for i in range(len(self.sinks)):
+            thread = threading.Thread(target=self._drain, args=(i,), name="alert-%s" % self.sinks[i].name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def publish(self, alert):
+        """放入各通道队列，不阻塞"""
+
+        for q, counter in zip(self.queues, self.counters):
+            try:
+                q.put_nowait(alert)
+            except queue.Full:
+                counter["dropped"] += 1
+
+    def _drain(self, i):
+        sink, q, counter = self.sinks[i], self.queues[i], self.counters[i]
+        while True:
+            alert = q.get()
+            if alert is None:
+                break
+            try:
+                sink.emit(alert)
+                counter["sent"] += 1
+            except Exception as e:
+                counter["failed"] += 1
+                print("FAIL: alert sink %s: %s" % (sink.name, e))
+
+    def stats(self):
+        """各通道的发送/丢弃/失败数及当前队列长度"""
+        return {
+            sink.name: dict(counter, queued=q.qsize())
+            for sink, q, counter in zip(self.sinks, self.queues, self.counters)
+        }
+
+    def close(self, timeout=5):
+        """发送完队列中的告警后关闭"""
+
+        for q in self.queues:
+            try:
+                q.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for sink, thread in zip(self.sinks, self.threads):
+            thread.join(timeout)
+            if thread.is_alive():    # 仍在发送，不关闭以免与发送中的告警冲突，随进程退出释放
+                print("FAIL: alert sink %s did not finish in %ss" % (sink.name, timeout))
+                continue
+            sink.close()
@@ -1,4 +1,6 @@
 import os
+import time
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -7,106 +9,280 @@ import utils
 
 sns.set(color_codes=True)
 
+MAX_BUCKETS = 24    # 桶编号上限 (小时0~23，星期1~7)
 
-def get_price_change_by_hour(data, i):
-    """获取基于小时的价格变动"""
-    v = data.prices[i] / data.prices[i - 1] - 1
-    time_triplet = utils.tic2time(data.tics[i]).split()[-1].split(":")
-    bucket_id = time_triplet[0]
-    return bucket_id, v
 
+def get_utc_offsets(tics):
+    """时间戳 (毫秒) 对应的本地时区相对UTC的秒数 (北京时间为28800)，与`time.localtime`一致 (含夏令时)
 
-def get_price_change_by_weekday(data, i):
-    """获取基于天的价格变动"""
-    v = data.prices[i] / data.prices[i - 1] - 1
-    tic = data.tics[i]
+    时区偏移只在整点变化，每个小时查询一次
+    """
+
+    hours, inverse = np.unique(np.asarray(tics, dtype=np.int64) // 3600000, return_inverse=True)
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff for hour in hours.tolist()], dtype=np.int64)
+    return offsets[inverse].reshape(np.shape(tics))
+
+
+def get_hour(tics):
+    """时间戳 (毫秒) 对应的本地小时 (0~23)"""
+    return (tics // 1000 + get_utc_offsets(tics)) // 3600 % 24
 
+
+def get_weekday(tics):
+    """时间戳 (毫秒) 对应的星期 (1~7，以北京时间计)"""
     # 基于2000年1月1日 (星期六) 计算是星期几
-    week_day = ((tic / 1000 - 946656000) // (24 * 60 * 60)) % 7 + 6
-    if week_day > 7:
-        week_day -= 7
-    bucket_id = week_day
-    return bucket_id, v
+    return ((tics // 1000 - 946656000) // (24 * 60 * 60) % 7 + 5) % 7 + 1
+
 
+def get_price_change_by_hour(data):
+    """获取基于小时的价格变动 (第i个值对应第i+1分钟)"""
+    v = data.prices[1:] / data.prices[:-1] - 1
+    return get_hour(data.tics[1:]), v
 
-def get_volume_by_hour(data, i):
+
+def get_price_change_by_weekday(data):
+    """获取基于天的价格变动"""
+    v = data.prices[1:] / data.prices[:-1] - 1
+    return get_weekday(data.tics[1:]), v
+
+
+def get_volume_by_hour(data):
     """获取基于小时的交易量变动"""
-    v = data.volumes[i]
-    time_triplet = utils.tic2time(data.tics[i]).split()[-1].split(":")
-    bucket_id = time_triplet[0]
-    return bucket_id, v
+    return get_hour(data.tics[1:]), data.volumes[1:]
 
 
-def get_volume_by_weekday(data, i):
+def get_volume_by_weekday(data):
     """获取基于天的交易量变动"""
-    v = data.volumes[i]
-    tic = data.tics[i]
+    return get_weekday(data.tics[1:]), data.volumes[1:]
 
-    # 基于2000年1月1日 (星期六) 计算是星期几
-    week_day = ((tic / 1000 - 946656000) // (24 * 60 * 60)) % 7 + 6
-    if week_day > 7:
-        week_day -= 7
-    bucket_id = week_day
-    return bucket_id, v
 
+def get_bucket_sums(f, data, start_timestamp, end_timestamp):
+    """各桶的求和与计数
+
+    returns: (sums, counts)，长度均为MAX_BUCKETS，下标即为bucket_id
+    """
+
+    tics = np.asarray(data.tics, dtype=np.int64)
+    bucket_ids, v = f(data)
+    mask = (tics[1:] >= start_timestamp * 1000) & (tics[1:] <= end_timestamp * 1000)    # 数据范围内
+    bucket_ids = bucket_ids[mask]
+    sums = np.bincount(bucket_ids, weights=np.asarray(v, dtype=np.float64)[mask], minlength=MAX_BUCKETS)
+    counts = np.bincount(bucket_ids, minlength=MAX_BUCKETS)
+    return sums, counts
 
-def statistics(f, data, start_timestamp, end_timestamp):
-    """获取排行分布"""
 
-    # 根据计量单位分桶
-    buckets = {}
-    for i in range(1, len(data.prices)):
-        tic = data.tics[i]
-        if tic / 1000 < start_timestamp or tic / 1000 > end_timestamp:    # 超出数据范围
-            continue
+def batch_statistics(f, datas, start_timestamp, end_timestamp):
+    """多币种的分桶均值
 
-        # 获取bucket_id和取值
-        bucket_id, v = f(data, i)
+    datas: {symbol: data}
+    returns: (symbols, bucket_ids, matrix)，matrix为 币种 x 桶 的均值矩阵，无数据的为NaN
+    """
 
-        # 注入桶中
-        if bucket_id not in buckets:
-            buckets[bucket_id] = []
-        buckets[bucket_id].append(v)
+    symbols = list(datas)
+    sums = np.zeros((len(symbols), MAX_BUCKETS))
+    counts = np.zeros((len(symbols), MAX_BUCKETS), dtype=np.int64)
+    for i, symbol in enumerate(symbols):
+        sums[i], counts[i] = get_bucket_sums(f, datas[symbol], start_timestamp, end_timestamp)
 
-    # 桶数据汇总
-    sorting_items = []
-    for bucket_id, v in buckets.items():
-        v = sum(v) / len(v)    # 取均值
-        sorting_items.append((bucket_id, v))
+    bucket_ids = np.flatnonzero(counts.sum(axis=0))    # 任一币种有数据的桶
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = sums[:, bucket_ids] / counts[:, bucket_ids]
+    return symbols, bucket_ids, matrix
+
+
+def plot_ranks(bucket_ids, means):
+    """按均值排名作图"""
 
-    # 排序
     indices = {}    # bucket_id -> 排名
-    sorting_items.sort(key=lambda x: x[-1], reverse=True)
-    for i, (bucket_id, v) in enumerate(sorting_items):
-        indices[bucket_id] = 24 - i
+    for i, j in enumerate(np.argsort(-means, kind="stable")):
+        indices[int(bucket_ids[j])] = 24 - i
 
-    # 作图
     x = list(sorted(indices.keys()))
     y = [indices[bucket_id] for bucket_id in x]
     plt.plot(x, y)
     # plt.scatter(x, y)
 
 
+def statistics(f, data, start_timestamp, end_timestamp):
+    """获取排行分布"""
+
+    # 根据计量单位分桶，桶数据取均值
+    sums, counts = get_bucket_sums(f, data, start_timestamp, end_timestamp)
+    bucket_ids = np.flatnonzero(counts)
+    plot_ranks(bucket_ids, sums[bucket_ids] / counts[bucket_ids])
+
+
+# 按天缓存的分桶聚合：每个币种每天、每个桶的求和与计数保存在`data/analysis/<SYMBOL>.npz`，
+# 数据文件增长后只重新计算最后一天及新增的天数；多个币种由进程池并发计算
+
+BUCKET_FUNCTIONS = {
+    "price_change_by_hour": get_price_change_by_hour,
+    "price_change_by_weekday": get_price_change_by_weekday,
+    "volume_by_hour": get_volume_by_hour,
+    "volume_by_weekday": get_volume_by_weekday,
+}
+CACHE_PATH = "data/analysis"
+CACHE_VERSION = 2    # 缓存格式或分桶方式变化时递增，旧版本的缓存重新计算
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_day(tics):
+    """时间戳 (毫秒) 对应的本地日期编号"""
+    return (tics // 1000 + get_utc_offsets(tics)) // SECONDS_PER_DAY
+
+
+def get_day_start(day):
+    """本地日期编号对应的0点的时间戳 (毫秒)"""
+
+    start = day * SECONDS_PER_DAY
+    start -= int(get_utc_offsets(start * 1000))    # 按UTC 0点的时区偏移估计
+    start = day * SECONDS_PER_DAY - int(get_utc_offsets(start * 1000))    # 以本地0点实际的时区偏移修正
+    return start * 1000
+
+
+def aggregate_by_day(data):
+    """按天分桶聚合
+
+    returns: {"days": 日期编号, name: sums, name + "_counts": counts}，sums/counts为 天 x 桶 的矩阵
+    """
+
+    days = get_day(np.asarray(data.tics[1:], dtype=np.int64))
+    if len(days) == 0:
+        return None
+    first_day = days[0]
+    n_days = int(days[-1] - first_day + 1)
+    aggregates = {"days": np.arange(first_day, first_day + n_days)}
+    for name, f in BUCKET_FUNCTIONS.items():
+        bucket_ids, v = f(data)
+        keys = (days - first_day) * MAX_BUCKETS + bucket_ids
+        size = n_days * MAX_BUCKETS
+        aggregates[name] = np.bincount(keys, weights=np.asarray(v, dtype=np.float64), minlength=size).reshape(n_days, MAX_BUCKETS)
+        aggregates[name + "_counts"] = np.bincount(keys, minlength=size).reshape(n_days, MAX_BUCKETS)
+
+    # 去掉没有数据的天
+    keep = np.bincount(days - first_day, minlength=n_days) > 0
+    return {key: value[keep] for key, value in aggregates.items()}
+
+
+def update_aggregates(symbol, file=None, path=CACHE_PATH):
+    """更新单个币种的按天聚合缓存，只重新计算缓存中最后一天及之后的数据
+
+    缓存中记录数据文件路径，与file不一致时重新计算
+
+    returns: (symbol, aggregates)，数据文件不存在时aggregates为None
+    """
+
+    file = file or data_loader.get_data_file(symbol)
+    if not os.path.exists(file):
+        return symbol, None
+    last_timestamp = data_loader.get_last_timestamp(file)
+    source = os.path.abspath(file)
+    cache_file = os.path.join(path, "%s.npz" % symbol)
+
+    cached = None
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as f:
+            cached = {key: f[key] for key in f.files}
+        cached_version = int(cached.pop("version", 0))
+        cached_source = str(cached.pop("source", ""))
+        cached_timestamp = int(cached.pop("last_timestamp"))
+        if cached_version != CACHE_VERSION or cached_source != source:    # 旧版本，或来自其他数据文件 (如`.backup/data`)
+            cached = None
+        elif last_timestamp is None or last_timestamp < cached_timestamp:    # 数据文件被重写
+            cached = None
+        elif last_timestamp == cached_timestamp:
+            return symbol, cached
+
+    start = None
+    if cached is not None:
+        start_day = int(cached["days"][-1])
+        # 从前一个有数据的日期开始读取，保证最后一天的第一条K线有前一条K线用于计算价格变动，重复的日期以新结果为准
+        start = get_day_start(int(cached["days"][-2]) if len(cached["days"]) > 1 else start_day)
+    aggregates = aggregate_by_day(data_loader.Data(file, start=start))
+    if cached is not None:
+        if aggregates is not None:
+            fresh = aggregates["days"] >= start_day
+            aggregates = {key: value[fresh] for key, value in aggregates.items()}
+        keep = cached["days"] < start_day
+        if aggregates is None:
+            aggregates = {key: value[keep] for key, value in cached.items()}
+        else:
+            aggregates = {
+                key: np.concatenate([cached[key][keep], value])
+                for key, value in aggregates.items()
+            }
+    if aggregates is None:
+        return symbol, None
+
+    utils.mkdir(os.path.dirname(cache_file))
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, "wb") as f:
+        np.savez(f, version=np.int64(CACHE_VERSION), source=np.array(source), last_timestamp=np.int64(last_timestamp), **aggregates)
+    os.replace(temp_file, cache_file)
+    return symbol, aggregates
+
+
+def _update_aggregates(args):
+    return update_aggregates(*args)
+
+
+def update_aggregates_all(symbols, pattern=None, processes=None, path=CACHE_PATH):
+    """多进程更新所有币种的按天聚合缓存
+
+    pattern: 数据文件路径模板，e.g. ".backup/data/%s.1m.data"，默认为`data_loader.get_data_file`
+    returns: {symbol: aggregates}
+    """
+
+    from multiprocessing import Pool
+
+    tasks = [(symbol, pattern % symbol if pattern else None, path) for symbol in symbols]
+    with Pool(processes) as pool:
+        results = pool.map(_update_aggregates, tasks)
+    return {symbol: aggregates for symbol, aggregates in results if aggregates is not None}
+
+
+def query_aggregates(aggregates, name, start_timestamp, end_timestamp):
+    """按日期范围 (秒，以天为粒度) 汇总多个币种的分桶均值
+
+    aggregates: `update_aggregates_all`的返回值
+    returns: (symbols, bucket_ids, matrix)，同`batch_statistics`
+    """
+
+    start_day = get_day(start_timestamp * 1000)
+    end_day = get_day(end_timestamp * 1000)
+    symbols = list(aggregates)
+    sums = np.zeros((len(symbols), MAX_BUCKETS))
+    counts = np.zeros((len(symbols), MAX_BUCKETS), dtype=np.int64)
+    for i, symbol in enumerate(symbols):
+        days = aggregates[symbol]["days"]
+        mask = (days >= start_day) & (days <= end_day)
+        sums[i] = aggregates[symbol][name][mask].sum(axis=0)
+        counts[i] = aggregates[symbol][name + "_counts"][mask].sum(axis=0)
+
+    bucket_ids = np.flatnonzero(counts.sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = sums[:, bucket_ids] / counts[:, bucket_ids]
+    return symbols, bucket_ids, matrix
+
+
 if __name__ == "__main__":
 
     # 设定数据统计初始/结尾年、月、日
     start_timestamp = utils.time2tic(2021, 7, 1, 0, 0, 0)
     end_timestamp = utils.time2tic(2021, 11, 1, 23, 59, 59)
 
+    # 多进程更新各币种的按天聚合缓存 (再次运行时只计算新增的数据)
+    aggregates = update_aggregates_all(data_loader.COINS[:50], pattern=".backup/data/%s.1m.data")
+
+    # name = "price_change_by_hour"    # 价格变动分布 (天)
+    # name = "price_change_by_weekday"    # 价格变动分布 (周)
+    # name = "volume_by_hour"    # 交易量分布 (天)
+    name = "volume_by_weekday"    # 交易量分布 (周)
+    symbols, bucket_ids, matrix = query_aggregates(aggregates, name, start_timestamp, end_timestamp)
+
     plt.figure()
-    for symbol in data_loader.COINS[:50]:
-
-        # 读取数据
-        file = ".backup/data/%s.1m.data" % symbol
-        if not os.path.exists(file):
-            continue
-        data = data_loader.Data(file)    # 读取历史数据
-        last_timestamp = data_loader.get_last_timestamp(file)
-        if not last_timestamp or last_timestamp < start_timestamp:
-            continue
-
-        # statistics(get_price_change_by_hour, data, start_timestamp, end_timestamp)    # 价格变动分布 (天)
-        # statistics(get_price_change_by_weekday, data, start_timestamp, end_timestamp)    # 价格变动分布 (周)
-        # statistics(get_volume_by_hour, data, start_timestamp, end_timestamp)    # 交易量分布 (天)
-        statistics(get_volume_by_weekday, data, start_timestamp, end_timestamp)    # 交易量分布 (周)
+    for means in matrix:
+        valid = ~np.isnan(means)
+        if valid.any():
+            plot_ranks(bucket_ids[valid], means[valid])
     plt.show()
@@ -0,0 +1,201 @@
+# 基于asyncio的币安行情客户端：多币种并发请求，按请求权重 (REQUEST_WEIGHT) 令牌桶限流
+
+import time
+import asyncio
+import aiohttp
+
+import metrics
+from planner import PagePlanner
+
+
+class TokenBucket:
+    """令牌桶限流器
+
+    令牌以 limit/interval 每秒的速度匀速补充，每次请求按接口权重消耗令牌；
+    服务端返回的已用权重用于校准剩余令牌，遇到429/418时暂停发放
+    """
+
+    def __init__(self, limit=1200, interval=60):
+        self.capacity = limit
+        self.rate = limit / interval
+        self.tokens = limit
+        self.last_tic = time.monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_tic) * self.rate)
+        self.last_tic = now
+
+    async def acquire(self, weight=1):
+        """获取weight个令牌，不足时等待"""
+
+        async with self.lock:
+            while True:
+                self._refill()
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    def sync(self, used_weight):
+        """根据服务端返回的当前窗口已用权重校准剩余令牌 (取两者中更保守的一方)"""
+        self._refill()
+        self.tokens = min(self.tokens, self.capacity - used_weight)
+
+    def pause(self, seconds):
+        """暂停发放令牌 (被限流时使用)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class AsyncBinanceAPI:
+    """异步获取币安行情，与`binance.BinanceAPI`的行情接口对应
+
+    用法:
+        async with AsyncBinanceAPI() as client:
+            data = await client.get_latest_data_many({"BTCUSDT": init_timestamp, ...})
+    """
+
+    BASE_URL = "https://www.binance.com/api/v3"
+    KLINES_WEIGHT = 2    # `/klines`接口权重
+    TICKERS_WEIGHT = 80    # 不指定币种的`/ticker/24hr`接口权重
+
+    def __init__(self, base_url=None, weight_limit=1200, concurrency=32, timeout=10, retries=3, verbosity=0):
+        self.base_url = base_url or self.BASE_URL
+        self.weight_limit = weight_limit    # 每分钟权重预算
+        self.concurrency = concurrency    # 最大并发连接数
+        self.timeout = timeout
+        self.retries = retries
+        self.verbosity = verbosity
+
+        self.session = None
+        self.bucket = None
+        self.semaphore = None
+        self.last_fail_tic = -1    # 上一次报错时间戳 (避免报错信息刷屏)
+
+    async def open(self):
+        """创建连接池 (需在事件循环中调用)"""
+        self.bucket = TokenBucket(self.weight_limit)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _fail(self, message):
+        if time.time() - self.last_fail_tic > 60:
+            print("FAIL: %s" % message)
+        self.last_fail_tic = time.time()
+
+    async def _request(self, path, params, weight=1):
+        """带限流和重试的GET请求，失败返回None"""
+
+        url = "%s%s" % (self.base_url, path)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.registry.inc("binance_retries_total", path=path)
+            await self.bucket.acquire(weight)
+            try:
+                async with self.semaphore:
+                    if self.verbosity:
+                        print("REQUEST: ", url, params)
+                    start = time.perf_counter()
+                    async with self.session.get(url, params=params) as response:
+                        metrics.registry.inc("binance_requests_total", path=path, status=response.status)
+                        used_weight = response.headers.get("X-MBX-USED-WEIGHT-1M") or response.headers.get("X-MBX-USED-WEIGHT")
+                        if used_weight:
+                            self.bucket.sync(int(used_weight))
+                        if response.status in (418, 429):    # 触发限流 (418为IP被封禁)
+                            retry_after = float(response.headers.get("Retry-After", 60))
+                            self._fail("rate limited (%d), retry after %ss" % (response.status, retry_after))
+                            self.bucket.pause(retry_after)
+                            continue
+                        if response.status >= 500:    # 服务端错误 (请求状态未知)，退避后重试
+                            self._fail("%s server error (%d)" % (url, response.status))
+                            await asyncio.sleep(min(0.5 * 2 ** attempt, 5))
+                            continue
+                        data = await response.json(content_type=None)
+                        metrics.registry.observe("binance_request_seconds", time.perf_counter() - start, path=path)
+                        return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                metrics.registry.inc("binance_requests_total", path=path, status=type(e).__name__)
+                self._fail("%s %r" % (url, e))
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 5))
+        metrics.registry.inc("binance_failures_total", path=path)
+        return None
+
+    async def get_time(self):
+        """获取服务器时间戳"""
+        return await self._request("/time", {})
+
+    async def get_prices(self, symbol, interval="1m", startTime=None, endTime=None, limit=None):
+        """获取区间价格，返回格式同`BinanceAPI.get_prices`"""
+
+        params = {"symbol": symbol, "interval": interval}
+        if startTime is not None:
+            params["startTime"] = startTime
+        if endTime is not None:
+            params["endTime"] = endTime
+        if limit is not None:
+            params["limit"] = limit
+        return await self._request("/klines", params, weight=self.KLINES_WEIGHT)
+
+    async def get_tickers(self):
+        """一次请求获取所有币种的24小时行情，返回格式同`BinanceAPI.get_price_change`的列表"""
+        return await self._request("/ticker/24hr", {}, weight=self.TICKERS_WEIGHT)
+
+    async def get_latest_data(self, symbol, interval, init_timestamp):
+        """获得最新的区间数据 (与`data_loader.get_latest_data`一致)
+
+        returns: K线列表，失败返回None
+        """
+
+        if interval != "1m":
+            raise ValueError("unsupported interval: %s" % interval)
+
+        now_timestamp = int(time.time() * 1000)
+        if now_timestamp < init_timestamp + 60 + 1000:    # 时间太近
+            return []
+        pages = PagePlanner(init_timestamp)
+        latest_data = []
+        while not pages.done:
+            start_timestamp, limit = pages.next_page()
+            data = await self.get_prices(symbol, interval, start_timestamp, limit=limit)
+            if isinstance(data, dict) and "code" in data:
+                self._fail("%s %s" % (symbol, data))
+                return None
+            elif not isinstance(data, list):
+                return None
+            latest_data += pages.feed(data)
+        return latest_data
+
+    async def get_latest_data_many(self, init_timestamps, interval="1m"):
+        """并发获取多个币种的最新数据
+
+        init_timestamps: {symbol: init_timestamp}
+        returns: {symbol: K线列表或None}
+        """
+
+        symbols = list(init_timestamps)
+        results = await asyncio.gather(*[
+            self.get_latest_data(symbol, interval, init_timestamps[symbol]) for symbol in symbols
+        ])
+        return dict(zip(symbols, results))
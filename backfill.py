@@ -0,0 +1,150 @@
+# 并发、可续传的历史数据下载
+#
+# 每个币种为一个下载任务，由多个worker在同一个请求权重预算下并发执行；
+# 每页取满1000条，并根据实际返回的数据推进下一页 (见`planner.PagePlanner`)，上线前/下线后无数据的区间不会被请求；
+# 每页数据交由`data_loader.writer`批量写入，落盘后才记录进检查点文件，中断后重新运行即从断点继续
+
+import os
+import json
+import time
+import asyncio
+
+import data_loader
+from async_binance import AsyncBinanceAPI
+from planner import PagePlanner
+
+
+CHECKPOINT_FILE = "data/backfill.json"
+
+
+class Backfill:
+    """多币种历史数据下载器
+
+    symbols: 币种列表
+    client: `AsyncBinanceAPI`实例 (None则自动创建)，所有worker共享其令牌桶
+    workers: 并发任务数
+    """
+
+    def __init__(self, symbols, client=None, workers=16, checkpoint=CHECKPOINT_FILE, report_interval=5, verbosity=1, base_url=None):
+        self.symbols = list(symbols)
+        self.client = client
+        self.base_url = base_url    # 自动创建client时使用的接口地址
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.report_interval = report_interval    # 打印进度/保存检查点的间隔 (秒)
+        self.verbosity = verbosity
+
+        self.progress = {}    # 各币种已覆盖到的时间戳 (下一次请求的起始时间)
+        self.failed = {}    # 下载失败的币种及原因
+        self.rows = 0    # 已下载K线条数
+        self.requests = 0    # 已请求页数
+        self.done = 0    # 已完成币种数
+
+    def load_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint, encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def save_checkpoint(self):
+        """原子写入检查点 (先将已下载的数据落盘，保证检查点不超前于数据文件)"""
+
+        data_loader.writer.flush()
+        if not self.checkpoint:
+            return
+        checkpoint = self.load_checkpoint()
+        checkpoint.update(self.progress)
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint)
+
+    def plan(self, now_timestamp):
+        """确定各币种的起始时间，返回需要下载的币种"""
+
+        checkpoint = self.load_checkpoint()
+        symbols = []
+        for symbol in self.symbols:
+            file = data_loader.get_data_file(symbol)
+            start = data_loader.get_init_timestamp(file, self.verbosity)
+            if os.path.exists(file):    # 文件被删除时检查点失效
+                start = max(start, checkpoint.get(symbol, 0))
+            self.progress[symbol] = start
+            if start + 60 * data_loader.TIMESTAMP_UNIT <= now_timestamp:    # 至少有一条已收线的K线
+                symbols.append(symbol)
+        return symbols
+
+    async def download(self, symbol, now_timestamp):
+        """按页下载单个币种，每页立即落盘"""
+
+        file = data_loader.get_data_file(symbol)
+        current_minute = now_timestamp // 60000 * 60000
+        pages = PagePlanner(self.progress[symbol])
+        while not pages.done:
+            start_timestamp, limit = pages.next_page()
+            data = await self.client.get_prices(symbol, "1m", start_timestamp, limit=limit)
+            if not isinstance(data, list):    # 重试后仍失败，放弃该币种 (不影响其他币种)
+                self.failed[symbol] = data
+                return
+            pages.feed(data)
+            self.requests += 1
+
+            rows = [item for item in data if int(item[6]) < now_timestamp]    # 只保存已收线的K线
+            data_loader.writer.append(file, rows)
+            self.rows += len(rows)
+            self.progress[symbol] = current_minute if pages.done else min(pages.start, current_minute)
+
+    async def _worker(self, queue, now_timestamp):
+        while True:
+            try:
+                symbol = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self.download(symbol, now_timestamp)
+            self.done += 1
+
+    async def _report(self, n_symbols, start_tic):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.save_checkpoint()
+            if self.verbosity:
+                elapsed = time.time() - start_tic
+                print("[%d/%d] %d次请求, %d条, %.0f条/秒" % (self.done, n_symbols, self.requests, self.rows, self.rows / elapsed))
+
+    async def run(self):
+        """执行下载，返回下载失败的币种"""
+
+        own_client = self.client is None
+        if own_client:
+            self.client = AsyncBinanceAPI(base_url=self.base_url, concurrency=self.workers)
+            await self.client.open()
+
+        now_timestamp = int(time.time() * data_loader.TIMESTAMP_UNIT)
+        symbols = self.plan(now_timestamp)
+        queue = asyncio.Queue()
+        for symbol in symbols:
+            queue.put_nowait(symbol)
+        if self.verbosity:
+            print("共%d个币种，其中%d个需要下载" % (len(self.symbols), len(symbols)))
+
+        start_tic = time.time()
+        reporter = asyncio.ensure_future(self._report(len(symbols), start_tic))
+        try:
+            await asyncio.gather(*[self._worker(queue, now_timestamp) for _ in range(self.workers)])
+        finally:
+            reporter.cancel()
+            self.save_checkpoint()
+            if own_client:
+                await self.client.close()
+
+        if self.verbosity:
+            elapsed = max(time.time() - start_tic, 1e-6)
+            print("下载完成: %d个币种, %d次请求, %d条, 耗时%.1f秒, %.0f条/秒" % (
+                self.done, self.requests, self.rows, elapsed, self.rows / elapsed))
+            for symbol, reason in self.failed.items():
+                print("FAIL: %s %s" % (symbol, reason))
+        return self.failed
+
+
+if __name__ == "__main__":
+    asyncio.run(Backfill(data_loader.COINS).run())
@@ -0,0 +1,270 @@
+# 告警规则回测：在历史数据上重放`rules.json`中的规则，输出所有会触发的告警 (含同类提示抑制)，统计告警数与命中率
+#
+# 每个币种的全部历史一次性向量化计算 (滑动平均、回看窗口等)，只有触发点需要逐个判断抑制状态；
+# 参数网格中的各组参数共享同一份中间量，多个币种由进程池并发计算
+#
+# python3 backtest.py --start 2021-07-01 --end 2022-01-01 --grid volume_spike.volume_ratio=5,10,20 --grid price_rise.rise=0.03,0.05
+
+import os
+import copy
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+
+import data_loader
+from alerts import Alert
+from rolling import moving_averages, parse_window
+from rules import RULES_FILE, RuleSet
+
+
+class SeriesContext:
+    """单个币种全部历史的上下文，接口与`rules.Context`一致，每个时间点相当于一行"""
+
+    def __init__(self, prices, volumes):
+        self.series = {"price": np.asarray(prices, dtype=np.float64), "volume": np.asarray(volumes, dtype=np.float64)}
+        self.n = len(prices)
+        self.cache = {}
+
+    def get(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def latest(self, series):
+        return self.series[series]
+
+    def ma(self, series, unit):
+        return self.get(("ma", series, unit), lambda: moving_averages(self.series[series], [unit])[unit])
+
+    def lag(self, series, unit):
+        """第i列 (从0开始) 为此前第i+1分钟的值，头部不足的为NaN"""
+
+        def compute():
+            values = self.series[series]
+            lags = np.full((self.n, unit), np.nan)
+            for i in range(unit):
+                lags[i + 1:, i] = values[:self.n - i - 1]
+            return lags
+        return self.get(("lag", series, unit), compute)
+
+    def max(self, series, unit):
+        return self.get(("max", series, unit), lambda: self.lag(series, unit).max(axis=1))
+
+    def min(self, series, unit):
+        return self.get(("min", series, unit), lambda: self.lag(series, unit).min(axis=1))
+
+    def change(self, series, unit):
+        return self.get(("change", series, unit), lambda: self.series[series][:, None] / self.lag(series, unit) - 1)
+
+
+def replay(rules, symbol, tics, context, warmup):
+    """按时间顺序执行规则 (与`MonitorEngine.execute`一致)，时间以K线开盘时间计
+
+    rules: 绑定到[symbol]的`RuleSet`
+    returns: [Alert, ...]
+    """
+
+    times = np.asarray(tics, dtype=np.int64) // 1000
+    blocked = np.zeros(context.n, dtype=bool)
+    blocked[:warmup] = True    # 数据不足以计算滑动平均/回看窗口
+    candidates = []    # 按规则顺序: (rule, hits, first, repeat_if)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for rule in rules:
+            if not rule.mask[0]:    # 规则不适用于该币种
+                continue
+            hits, first = rule.evaluate(context)
+            hits = hits & ~blocked
+            if rule.exclusive:
+                blocked |= hits
+            if hits.any():
+                repeat_if = rule.repeat_if(context) if rule.repeat_if is not None else None
+                candidates.append((rule, hits, first, repeat_if))
+
+        # 逐个触发点判断同类提示抑制
+        events = sorted(
+            (t, k) for k, (rule, hits, first, repeat_if) in enumerate(candidates) for t in np.flatnonzero(hits)
+        )
+        alerts = []
+        values = {}
+        last_alarm, last_alarm_tic = 0, -1.0
+        for t, k in events:
+            rule, hits, first, repeat_if = candidates[k]
+            expired = times[t] - last_alarm_tic > rule.repeat_after
+            if repeat_if is not None:
+                expired = expired and bool(repeat_if[t])
+            if last_alarm == rule.alarm and not expired:
+                continue
+            if rule.name not in values:
+                values[rule.name] = {name: expression(context) for name, expression in rule.values.items()}
+            alerts.append(Alert(
+                int(tics[t]),
+                symbol,
+                float(context.latest("price")[t]),
+                rule.name,
+                rule.alarm,
+                rule.format(context, t, first, values[rule.name]),
+                color=rule.color,
+                sound=rule.sound,
+            ))
+            last_alarm, last_alarm_tic = rule.alarm, times[t]
+    return alerts
+
+
+def get_warmup(rules):
+    """规则需要的最少历史分钟数"""
+    units = [unit for series_units in rules.moving_averages().values() for unit in series_units]
+    return max(units + [rules.lookback + 1])
+
+
+def parse_grid(items):
+    """["volume_spike.volume_ratio=5,10,20", ...] -> [{(rule, param): value, ...}, ...] (笛卡尔积)"""
+
+    axes = []
+    for item in items:
+        key, values = item.split("=")
+        rule, param = key.split(".")
+        axes.append([((rule, param), float(value)) for value in values.split(",")])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def build_rules(config, params, symbols):
+    """按params覆盖规则参数，并绑定到symbols"""
+
+    config = copy.deepcopy(config)
+    for (name, param), value in params.items():
+        rules = [rule for rule in config["rules"] if rule["name"] == name]
+        if not rules:
+            raise ValueError("unknown rule: %s" % name)
+        rules[0].setdefault("params", {})[param] = value
+    return RuleSet(config).bind(symbols)
+
+
+def backtest_symbol(args):
+    """单个币种在各组参数下的告警及其之后horizon分钟的涨跌幅
+
+    returns: (symbol, [[(alert, 之后的涨跌幅), ...] 每组参数一个列表])
+    """
+
+    symbol, file, config, grid, start, end, horizon = args
+    rule_sets = [build_rules(config, params, [symbol]) for params in grid]
+    warmup = max(get_warmup(rules) for rules in rule_sets)
+    data = data_loader.Data(file, start=None if start is None else start - warmup * 60000, end=end)
+    if len(data.tics) <= warmup:
+        return symbol, [[] for _ in grid]
+    context = SeriesContext(data.prices, data.volumes)
+    prices = context.latest("price")
+
+    results = []
+    for rules in rule_sets:
+        items = []
+        for alert in replay(rules, symbol, data.tics, context, warmup):
+            t = np.searchsorted(data.tics, alert.tic)
+            future = prices[t + horizon] / prices[t] - 1 if t + horizon < len(prices) else np.nan
+            items.append((alert, float(future)))
+        results.append(items)
+    return symbol, results
+
+
+def run(symbols=None, rules_file=RULES_FILE, grid=(), start=None, end=None, horizon="1h", processes=None, verbosity=1):
+    """在所有币种上回测各组参数
+
+    grid: `parse_grid`的返回值，为空时只回测`rules.json`中的参数
+    start/end: 回测区间 (毫秒)
+    returns: [(params, [(alert, 之后的涨跌幅), ...]), ...]
+    """
+
+    from multiprocessing import Pool
+
+    with open(rules_file, encoding="utf-8") as f:
+        config = json.load(f)
+    grid = list(grid) or [{}]
+    symbols = [symbol for symbol in (symbols or data_loader.COINS) if os.path.exists(data_loader.get_data_file(symbol))]
+    horizon = parse_window(horizon)
+    tasks = [
+        (symbol, data_loader.get_data_file(symbol), config, grid, start, end, horizon)
+        for symbol in symbols
+    ]
+
+    results = [[] for _ in grid]
+    start_tic = time.time()
+    with Pool(processes) as pool:
+        for i, (symbol, items) in enumerate(pool.imap_unordered(backtest_symbol, tasks)):
+            for k, alerts in enumerate(items):
+                results[k] += alerts
+            if verbosity and (i + 1) % 50 == 0:
+                print("[%d/%d] %.1f秒" % (i + 1, len(tasks), time.time() - start_tic))
+    for items in results:
+        items.sort(key=lambda item: (item[0].tic, item[0].symbol))
+    return list(zip(grid, results))
+
+
+def summarize(items):
+    """按规则统计告警数与命中率 (之后horizon分钟内按提示方向变动的比例) 及平均涨跌幅"""
+
+    summary = {}
+    for alert, future in items:
+        stats = summary.setdefault(alert.rule, {"alerts": 0, "hits": 0, "returns": []})
+        stats["alerts"] += 1
+        if not np.isnan(future):
+            stats["hits"] += int(future * alert.alarm > 0)
+            stats["returns"].append(future * alert.alarm)
+    for stats in summary.values():
+        returns = stats.pop("returns")
+        stats["hit_rate"] = stats["hits"] / len(returns) if returns else float("nan")
+        stats["mean_return"] = float(np.mean(returns)) if returns else float("nan")
+    return summary
+
+
+def parse_date(date):
+    """"2021-07-01" -> 毫秒时间戳 (本地时间)"""
+    return int(time.mktime(time.strptime(date, "%Y-%m-%d"))) * data_loader.TIMESTAMP_UNIT
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="告警规则回测")
+    parser.add_argument("--rules", default=RULES_FILE, help="告警规则配置文件")
+    parser.add_argument("--symbols", default=None, help="逗号分隔的币种 (默认为全部已下载的币种)")
+    parser.add_argument("--start", default=None, help="开始日期, e.g. 2021-07-01")
+    parser.add_argument("--end", default=None, help="结束日期 (不含)")
+    parser.add_argument("--grid", action="append", default=[], help="参数网格, e.g. volume_spike.volume_ratio=5,10,20 (可重复)")
+    parser.add_argument("--horizon", default="1h", help="计算命中率的时间窗口")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--alerts", default=None, help="将所有告警写入该文件 (每行一条JSON)")
+    parser.add_argument("--save", default=None, help="将统计结果保存为JSON")
+    args = parser.parse_args()
+
+    results = run(
+        args.symbols.split(",") if args.symbols else None,
+        args.rules,
+        parse_grid(args.grid),
+        parse_date(args.start) if args.start else None,
+        parse_date(args.end) if args.end else None,
+        args.horizon,
+        args.processes,
+    )
+
+    report = []
+    for params, items in results:
+        summary = summarize(items)
+        report.append({"params": {"%s.%s" % key: value for key, value in params.items()}, "rules": summary})
+        print(", ".join("%s.%s=%s" % (rule, param, value) for (rule, param), value in params.items()) or "rules.json")
+        for rule, stats in summary.items():
+            print("    %-16s %6d条, 命中率%.1f%%, 平均涨跌幅%.2f%%" % (
+                rule, stats["alerts"], stats["hit_rate"] * 100, stats["mean_return"] * 100,
+            ))
+
+    if args.alerts:
+        with open(args.alerts, "w", encoding="utf-8") as f:
+            for params, items in results:
+                for alert, future in items:
+                    item = alert.to_dict()
+                    item.pop("created")
+                    item["params"] = {"%s.%s" % key: value for key, value in params.items()}
+                    item["future_return"] = future
+                    f.write("%s\n" % json.dumps(item, ensure_ascii=False))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
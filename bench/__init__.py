@@ -0,0 +1 @@
+# 性能基准：合成K线数据生成器 + 热点路径计时，结果保存为JSON，可与基准结果比较 (见`bench/run.py`)
@@ -0,0 +1,71 @@
+# 一致性检查：相同的合成数据逐分钟输入逐币种的参考实现 (`monitor.Monitor`) 和监控引擎，比较两者的提示
+#
+# python3 -m bench.check --symbols 10 --minutes 5000    # 不一致时返回非零退出码
+
+import io
+import sys
+import argparse
+import contextlib
+from unittest import mock
+
+import data_loader
+import monitor
+from alerts import AlertDispatcher, Sink
+from engine import MonitorEngine
+from bench.generator import generate_klines
+
+
+class CollectSink(Sink):
+    name = "collect"
+
+    def __init__(self):
+        self.alerts = []
+
+    def emit(self, alert):
+        self.alerts.append(alert)
+
+
+def check(symbols=10, minutes=5000, seed=0):
+    """returns: (参考实现的提示, 引擎的提示)，均为排序后的提示文本"""
+
+    names = ["BTCUSDT"] + ["SYM%d" % i for i in range(1, symbols)]    # 下跌提示只针对BTCUSDT
+    capacity = data_loader.DAY * 7
+    records = {name: generate_klines(capacity + minutes, seed=seed + i) for i, name in enumerate(names)}
+
+    monitors = [
+        monitor.Monitor(name, r["open_time"][:capacity], r["close"][:capacity], r["quote_volume"][:capacity])
+        for name, r in records.items()
+    ]
+    sink = CollectSink()
+    dispatcher = AlertDispatcher([sink])
+    engine = MonitorEngine(names, capacity, dispatcher=dispatcher)
+    for name, r in records.items():
+        engine.load(name, r["open_time"][:capacity], r["close"][:capacity], r["quote_volume"][:capacity])
+
+    output = io.StringIO()
+    with mock.patch("pygame.mixer.music.play"), mock.patch("time.sleep"), contextlib.redirect_stdout(output):
+        for t in range(capacity, capacity + minutes):
+            for m, r in zip(monitors, records.values()):
+                m.update(r["open_time"][t], r["close"][t], r["quote_volume"][t])
+                m.execute()
+            engine.feed({name: [r[t].tolist()] for name, r in records.items()})
+    dispatcher.close()
+
+    return sorted(output.getvalue().splitlines()), sorted(alert.text() for alert in sink.alerts)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="监控引擎与参考实现的一致性检查")
+    parser.add_argument("--symbols", type=int, default=10, help="合成数据的币种数 (第一个为BTCUSDT)")
+    parser.add_argument("--minutes", type=int, default=5000, help="逐分钟执行的分钟数")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据的随机种子")
+    args = parser.parse_args()
+
+    reference, alerts = check(args.symbols, args.minutes, args.seed)
+    if reference != alerts:
+        print("FAIL: 参考实现%d条提示，引擎%d条提示" % (len(reference), len(alerts)))
+        for line in sorted(set(reference) ^ set(alerts)):
+            print(("参考实现: %s" if line in reference else "引擎: %s") % line)
+        sys.exit(1)
+    print("一致: %d条提示" % len(alerts))
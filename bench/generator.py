@@ -0,0 +1,82 @@
+# 合成1分钟K线数据，格式与币安`/klines`一致 (12列)，相同参数生成的数据完全相同
+
+import numpy as np
+
+import candle_store
+
+
+START_TIMESTAMP = 1625097600000    # 2021年7月1日 08:00:00 (北京时间)
+
+
+def generate_klines(minutes, seed=0, start_timestamp=START_TIMESTAMP, price=100.0):
+    """生成一个币种的K线
+
+    价格为几何布朗运动；交易额带有日内周期，并随机出现突增 (用于触发监控规则)
+    returns: 结构化数组 (`candle_store.RECORD_DTYPE`)
+    """
+
+    rng = np.random.default_rng(seed)
+    tics = start_timestamp + np.arange(minutes, dtype=np.int64) * 60000
+    closes = price * np.exp(np.cumsum(rng.normal(0, 0.001, minutes)))
+    opens = np.concatenate([[price], closes[:-1]])
+    spread = np.abs(rng.normal(0, 0.0005, minutes)) * closes
+    highs = np.maximum(opens, closes) + spread
+    lows = np.minimum(opens, closes) - spread
+
+    hours = (tics // 3600000) % 24
+    quote_volumes = rng.lognormal(10, 0.5, minutes) * (1 + 0.5 * np.sin(hours / 24 * 2 * np.pi))
+    spikes = rng.random(minutes) < 0.0005
+    quote_volumes[spikes] *= rng.uniform(10, 50, spikes.sum())
+    volumes = quote_volumes / closes
+    trades = (quote_volumes / 1000).astype(np.int64) + 1
+    taker_ratio = rng.uniform(0.3, 0.7, minutes)
+
+    records = np.empty(minutes, dtype=candle_store.RECORD_DTYPE)
+    records["open_time"] = tics
+    records["open"] = opens
+    records["high"] = highs
+    records["low"] = lows
+    records["close"] = closes
+    records["volume"] = volumes
+    records["close_time"] = tics + 59999
+    records["quote_volume"] = quote_volumes
+    records["trades"] = trades
+    records["taker_base_volume"] = volumes * taker_ratio
+    records["taker_quote_volume"] = quote_volumes * taker_ratio
+    return records
+
+
+def write_tsv(file, records):
+    """按旧版TSV格式 (`data_loader.Data`可解析的12列) 写入"""
+
+    with open(file, "w", encoding="utf-8") as f:
+        for record in records.tolist():
+            f.write("%d\t%.8f\t%.8f\t%.8f\t%.8f\t%.8f\t%d\t%.8f\t%d\t%.8f\t%.8f\t0\n" % record)
+
+
+def write_store(file, records):
+    """按二进制格式写入"""
+
+    with open(file, "wb") as f:
+        candle_store.write_header(f)
+        f.write(records.tobytes())
+
+
+def generate_dataset(path, symbols=10, days=7, seed=0, formats=("tsv", "bin")):
+    """在path下生成symbols个币种、days天的数据文件
+
+    returns: {symbol: {format: file}}
+    """
+
+    files = {}
+    for i in range(symbols):
+        symbol = "SYN%03dUSDT" % i
+        records = generate_klines(days * 24 * 60, seed=seed + i, price=10.0 ** (i % 5))
+        files[symbol] = {}
+        if "tsv" in formats:
+            files[symbol]["tsv"] = "%s/%s.1m.data" % (path, symbol)
+            write_tsv(files[symbol]["tsv"], records)
+        if "bin" in formats:
+            files[symbol]["bin"] = "%s/%s.1m%s" % (path, symbol, candle_store.SUFFIX)
+            write_store(files[symbol]["bin"], records)
+    return files
@@ -0,0 +1,189 @@
+# 热点路径基准测试
+#
+# python3 -m bench.run --save bench.json                       # 运行并保存结果
+# python3 -m bench.run --compare bench.json --threshold 0.2    # 与基准结果比较，吞吐下降超过20%时返回非零退出码
+
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+import data_loader
+from alerts import AlertDispatcher
+from engine import MonitorEngine
+from bench.generator import generate_dataset
+
+
+def measure(fn, setup=None, repeat=3):
+    """执行repeat次，返回最短耗时 (秒)；setup的返回值作为fn的参数，不计入耗时"""
+
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        with contextlib.redirect_stdout(io.StringIO()):    # 屏蔽读取数据时的打印
+            start = time.perf_counter()
+            fn(*args)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_data(files, fmt, repeat):
+    def fn():
+        for item in files.values():
+            data = data_loader.Data(item[fmt])
+            data.prices.sum()    # 确保内存映射的数据被实际读取
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = sum(len(data_loader.Data(item[fmt]).tics) for item in files.values())
+    return measure(fn, repeat=repeat), rows, "rows"
+
+
+def bench_data_tail(files, fmt, repeat):
+    """只读取最近7天"""
+    def fn():
+        for item in files.values():
+            last = data_loader.get_last_timestamp(item[fmt])
+            data_loader.Data(item[fmt], start=last - (data_loader.DAY * 7 - 1) * 60000).prices.sum()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()    # 首次读取时建立按天偏移索引，不计入耗时
+    return measure(fn, repeat=repeat), len(files) * data_loader.DAY * 7, "rows"
+
+
+def bench_last_timestamp(files, fmt, repeat):
+    def fn():
+        for item in files.values():
+            data_loader.get_last_timestamp(item[fmt])
+    return measure(fn, repeat=repeat), len(files), "files"
+
+
+def bench_moving_average(datas, repeat):
+    def fn():
+        for data in datas.values():
+            data_loader.get_moving_average(data.prices, "7h")
+    return measure(fn, repeat=repeat), sum(len(data.prices) for data in datas.values()), "rows"
+
+
+def bench_engine(datas, minutes, repeat):
+    """逐分钟批量update + execute，单位为 币种 x 分钟"""
+
+    symbols = list(datas)
+    capacity = data_loader.DAY * 7
+
+    def setup():
+        engine = MonitorEngine(symbols, capacity, dispatcher=AlertDispatcher([]))
+        for symbol, data in datas.items():
+            engine.load(symbol, data.tics[:-minutes], data.prices[:-minutes], data.volumes[:-minutes])
+        return engine,
+
+    def fn(engine):
+        rows = np.arange(len(symbols))
+        tics = np.stack([data.tics[-minutes:] for data in datas.values()])
+        prices = np.stack([data.prices[-minutes:] for data in datas.values()])
+        volumes = np.stack([data.volumes[-minutes:] for data in datas.values()])
+        for t in range(minutes):
+            engine.update(rows, tics[0, t], prices[:, t], volumes[:, t])
+            engine.execute(rows, now=tics[0, t] / 1000)
+
+    return measure(fn, setup, repeat), len(symbols) * minutes, "symbol-minutes"
+
+
+def bench_statistics(datas, repeat):
+    import analyze    # 依赖matplotlib
+
+    start_timestamp = min(int(data.tics[0]) for data in datas.values()) // 1000
+    end_timestamp = max(int(data.tics[-1]) for data in datas.values()) // 1000
+
+    def fn():
+        for f in (analyze.get_price_change_by_hour, analyze.get_volume_by_weekday):
+            analyze.batch_statistics(f, datas, start_timestamp, end_timestamp)
+    return measure(fn, repeat=repeat), 2 * sum(len(data.tics) for data in datas.values()), "rows"
+
+
+def run(symbols=20, days=8, minutes=60, repeat=3, path=None, verbosity=1):
+    """生成数据并运行所有基准
+
+    returns: {"config": 参数, "results": {name: {"seconds", "items", "unit", "rate"}}}
+    """
+
+    own_path = path is None
+    path = path or tempfile.mkdtemp(prefix="bench-")
+    try:
+        if verbosity:
+            print("生成%d个币种、%d天的数据 (%s)..." % (symbols, days, path))
+        files = generate_dataset(path, symbols, days)
+        with contextlib.redirect_stdout(io.StringIO()):
+            datas = {symbol: data_loader.Data(item["bin"]) for symbol, item in files.items()}
+
+        benchmarks = {
+            "data_tsv": lambda: bench_data(files, "tsv", repeat),
+            "data_bin": lambda: bench_data(files, "bin", repeat),
+            "data_tail_tsv": lambda: bench_data_tail(files, "tsv", repeat),
+            "data_tail_bin": lambda: bench_data_tail(files, "bin", repeat),
+            "last_timestamp_tsv": lambda: bench_last_timestamp(files, "tsv", repeat),
+            "last_timestamp_bin": lambda: bench_last_timestamp(files, "bin", repeat),
+            "moving_average": lambda: bench_moving_average(datas, repeat),
+            "engine": lambda: bench_engine(datas, minutes, repeat),
+            "statistics": lambda: bench_statistics(datas, repeat),
+        }
+        results = {}
+        for name, benchmark in benchmarks.items():
+            try:
+                seconds, items, unit = benchmark()
+            except ImportError as e:
+                print("FAIL: %s: %s" % (name, e))
+                continue
+            results[name] = {"seconds": seconds, "items": items, "unit": unit, "rate": items / seconds}
+            if verbosity:
+                print("%-20s %10.4fs %14.0f %s/s" % (name, seconds, items / seconds, unit))
+    finally:
+        if own_path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    config = {"symbols": symbols, "days": days, "minutes": minutes, "repeat": repeat, "python": sys.version.split()[0]}
+    return {"config": config, "results": results}
+
+
+def compare(results, baseline, threshold=0.2):
+    """与基准结果比较吞吐，返回下降超过threshold的项目"""
+
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["rate"] / baseline["results"][name]["rate"]
+        flag = ""
+        if ratio < 1 - threshold:
+            regressions.append(name)
+            flag = " <<< REGRESSION"
+        print("%-20s %6.2fx%s" % (name, ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="热点路径基准测试")
+    parser.add_argument("--symbols", type=int, default=20, help="合成数据的币种数")
+    parser.add_argument("--days", type=int, default=8, help="合成数据的天数 (监控引擎需要至少7天)")
+    parser.add_argument("--minutes", type=int, default=60, help="监控引擎基准逐分钟执行的分钟数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数 (取最短耗时)")
+    parser.add_argument("--path", default=None, help="合成数据目录 (默认为临时目录，结束后删除)")
+    parser.add_argument("--save", default=None, help="保存结果的JSON文件")
+    parser.add_argument("--compare", default=None, help="作为基准的JSON结果文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="吞吐下降超过该比例视为性能回退")
+    args = parser.parse_args()
+
+    results = run(args.symbols, args.days, args.minutes, args.repeat, args.path)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"]:
+            print("FAIL: config mismatch: %s vs %s" % (baseline["config"], results["config"]))
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
@@ -8,7 +8,10 @@ import hmac
 import pprint
 import hashlib
 import urllib
+import threading
+from requests.adapters import HTTPAdapter
 
+import metrics
 import utils
 
 
@@ -21,20 +24,26 @@ class BinanceAPI:
     FUTURE_URL = "https://fapi.binance.com"
     PUBLIC_URL = "https://www.binance.com/exchange/public/product"
 
-    def __init__(self, key, secret, verbosity=0):
+    def __init__(self, key, secret, verbosity=0, pool_size=32, connect_timeout=5, read_timeout=30, base_url=None):
         self.key = key    # API Key
         self.secret = secret    # Secret Key
+        self.base_url = base_url or self.BASE_URL    # 可指向本地模拟接口 (见`mock_binance.py`)
         self.verbosity = verbosity
+        self.timeout = (connect_timeout, read_timeout)    # 建立连接/读取响应超时 (秒)
 
         self.last_fail_tic = -1    # 上一次报错时间戳 (避免报错信息刷屏，距离上一次报错太近则不报错)
 
+        # 所有线程共享同一个连接池 (urllib3连接池是线程安全的)，每个线程使用各自的Session
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self._local = threading.local()
+
     def get_ping(self):
         """检测是否与服务器连接成功
 
         returns: {}
         """
 
-        url = "%s/ping" % self.BASE_URL
+        url = "%s/ping" % self.base_url
         params = {}
 
         # 请求
@@ -52,7 +61,7 @@ class BinanceAPI:
         returns: {'serverTime': 1635406440050}
         """
 
-        url = "%s/time" % self.BASE_URL
+        url = "%s/time" % self.base_url
         params = {}
 
         # 请求
@@ -73,7 +82,7 @@ class BinanceAPI:
         }
         """
 
-        url = "%s/ticker/price" % self.BASE_URL
+        url = "%s/ticker/price" % self.base_url
         params = {}
         if symbol:
             params["symbol"] = symbol
@@ -113,7 +122,7 @@ class BinanceAPI:
         }
         """
 
-        url = "%s/ticker/%s" % (self.BASE_URL, interval)
+        url = "%s/ticker/%s" % (self.base_url, interval)
         params = {"symbol": symbol}
 
         # 请求
@@ -137,7 +146,7 @@ class BinanceAPI:
         }
         """
 
-        url = "%s/ticker/bookTicker" % self.BASE_URL
+        url = "%s/ticker/bookTicker" % self.base_url
         params = {"symbol": symbol}
 
         # 请求
@@ -149,7 +158,7 @@ class BinanceAPI:
             self.last_fail_tic = time.time()
             return
 
-    def get_prices(self, symbol, interval="1m", startTime=None, endTime=None):
+    def get_prices(self, symbol, interval="1m", startTime=None, endTime=None, limit=None):
         """获取区间价格
 
         returns: [
@@ -171,12 +180,14 @@ class BinanceAPI:
         ]
         """
 
-        url = "%s/klines" % self.BASE_URL
-        params = None
-        if startTime is None:
-            params = {"symbol": symbol, "interval": interval}
-        else:
-            params = {"symbol": symbol, "interval": interval, "startTime": startTime, "endTime": endTime}
+        url = "%s/klines" % self.base_url
+        params = {"symbol": symbol, "interval": interval}
+        if startTime is not None:
+            params["startTime"] = startTime
+        if endTime is not None:
+            params["endTime"] = endTime
+        if limit is not None:    # 单次返回条数，最多1000
+            params["limit"] = limit
 
         # 请求
         try:
@@ -205,7 +216,7 @@ class BinanceAPI:
         ]
         """
 
-        url = "%s/aggTrades" % self.BASE_URL
+        url = "%s/aggTrades" % self.base_url
         params = {"symbol": symbol, "limit": limit}
         if startTime:
             params["startTime"] = startTime
@@ -250,7 +261,7 @@ class BinanceAPI:
         }
         """
 
-        url = "%s/account" % self.BASE_URL
+        url = "%s/account" % self.base_url
         params = {"recvWindow": 5000, "timestamp": int(1000 * time.time())}
 
         # 请求
@@ -327,7 +338,7 @@ class BinanceAPI:
             print("FAIL: quantity/value cannot be not NONE together")
             return
 
-        url = "%s/order" % self.BASE_URL
+        url = "%s/order" % self.base_url
         params = {"timestamp": int(1000 * time.time())}
 
         if limit_price is not None:    # 限价委托
@@ -350,6 +361,40 @@ class BinanceAPI:
             self.last_fail_tic = time.time()
             return
 
+    def get_connection_stats(self):
+        """获取各host的连接复用情况
+
+        returns: {
+            'https://www.binance.com': {'requests': 120, 'connections': 2, 'reused': 118},
+        }
+        """
+
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = "%s://%s" % (pool.scheme, pool.host)
+            if pool.port not in (None, 80, 443):
+                host += ":%d" % pool.port
+            stats[host] = {
+                "requests": pool.num_requests,
+                "connections": pool.num_connections,
+                "reused": pool.num_requests - pool.num_connections,
+            }
+        return stats
+
+    def _get_session(self):
+        """获取当前线程的Session (长连接，支持gzip)"""
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            session.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+            self._local.session = session
+        return session
+
     def _request_with_sign(self, url, params):
         """带有签名的HTTP请求"""
 
@@ -361,7 +406,7 @@ class BinanceAPI:
             print("REQUEST: ", url)
 
         # 请求
-        data = requests.get(url, headers=header, timeout=180, verify=True)
+        data = self._get_session().get(url, headers=header, timeout=self.timeout, verify=True)
         try:
             return data.json()
         except Exception:
@@ -375,7 +420,15 @@ class BinanceAPI:
             print("REQUEST: ", url)
 
         # 请求
-        data = requests.get(url, timeout=180, verify=True)
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        start = time.perf_counter()
+        try:
+            data = self._get_session().get(url, timeout=self.timeout, verify=True)
+        except Exception as e:
+            metrics.registry.inc("binance_requests_total", path=path, status=type(e).__name__)
+            raise
+        metrics.registry.inc("binance_requests_total", path=path, status=data.status_code)
+        metrics.registry.observe("binance_request_seconds", time.perf_counter() - start, path=path)
         try:
             return data.json()
         except Exception:
@@ -408,6 +461,7 @@ with open("api.conf", encoding="utf-8") as f:
     instance = BinanceAPI(
         api_conf["API Key"],
         api_conf["Secret Key"],
+        base_url=os.environ.get("BINANCE_API_URL") or api_conf.get("API URL"),
     )
 
 
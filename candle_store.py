@@ -0,0 +1,251 @@
+# 二进制K线存储：定长记录 + 内存映射，按列零拷贝读取
+#
+# 文件格式：
+#   [16字节文件头] MAGIC(4) + 版本号(uint16) + 记录长度(uint16) + 保留(8)
+#   [N条定长记录] 每条记录依次为 RECORD_DTYPE 中的各列 (小端序)
+#
+# 通过`np.memmap`映射后，`records["close"]`等即为对应列的零拷贝视图
+
+import os
+import time
+import struct
+import numpy as np
+
+
+MAGIC = b"BNKL"
+VERSION = 1
+SUFFIX = ".bin"
+HEADER_FORMAT = "<4sHH8x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)    # 16字节
+
+# 与币安`/klines`返回的前11列一一对应 (第12列为无意义字段，不予存储)
+RECORD_DTYPE = np.dtype([
+    ("open_time", "<i8"),             # 开盘时间
+    ("open", "<f8"),                  # 开盘价
+    ("high", "<f8"),                  # 最高价
+    ("low", "<f8"),                   # 最低价
+    ("close", "<f8"),                 # 收盘价
+    ("volume", "<f8"),                # 成交量
+    ("close_time", "<i8"),            # 收盘时间
+    ("quote_volume", "<f8"),          # 成交额
+    ("trades", "<i8"),                # 成交笔数
+    ("taker_base_volume", "<f8"),     # 主动买入成交量
+    ("taker_quote_volume", "<f8"),    # 主动买入成交额
+])
+RECORD_SIZE = RECORD_DTYPE.itemsize    # 88字节
+
+
+def is_store(file):
+    """根据后缀判断是否为二进制K线文件"""
+    return file.endswith(SUFFIX)
+
+
+def to_records(rows):
+    """将API返回 (或TSV解析得到) 的K线列表转换为结构化数组"""
+
+    records = np.empty(len(rows), dtype=RECORD_DTYPE)
+    if not rows:
+        return records
+    columns = list(zip(*rows))
+    for i, name in enumerate(RECORD_DTYPE.names):
+        records[name] = np.asarray(columns[i], dtype=RECORD_DTYPE[name])
+    return records
+
+
+def write_header(f):
+    """写入文件头"""
+    f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE))
+
+
+def check_header(f, file):
+    """校验文件头"""
+
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("invalid candle store (truncated header): %s" % file)
+    magic, version, record_size = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+        raise ValueError("invalid candle store (magic=%s, version=%s): %s" % (magic, version, file))
+
+
+def count(file):
+    """获取文件中完整记录的条数 (忽略末尾不完整的记录)"""
+
+    if not os.path.exists(file):
+        return 0
+    size = os.path.getsize(file)
+    if size <= HEADER_SIZE:
+        return 0
+    return (size - HEADER_SIZE) // RECORD_SIZE
+
+
+def load(file):
+    """以只读方式内存映射整个文件
+
+    returns: 结构化数组，records["open_time"]/records["close"]等为零拷贝的列视图
+    """
+
+    n = count(file)
+    if n == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    with open(file, "rb") as f:
+        check_header(f, file)
+    return np.memmap(file, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(n,))
+
+
+def append(file, rows):
+    """追加K线数据，文件不存在时自动创建"""
+
+    records = rows if isinstance(rows, np.ndarray) else to_records(rows)
+    if len(records) == 0:
+        return
+    new = not os.path.exists(file) or os.path.getsize(file) == 0
+    with open(file, "ab") as f:
+        if new:
+            write_header(f)
+        f.write(records.astype(RECORD_DTYPE, copy=False).tobytes())
+
+
+def last_timestamp(file):
+    """直接定位到最后一条记录读取开盘时间，O(1)"""
+
+    n = count(file)
+    if n == 0:
+        return None
+    with open(file, "rb") as f:
+        f.seek(HEADER_SIZE + (n - 1) * RECORD_SIZE)
+        record = np.frombuffer(f.read(RECORD_SIZE), dtype=RECORD_DTYPE)
+    return int(record["open_time"][0])
+
+
+def repair(file):
+    """截掉末尾不完整的记录 (写入中途崩溃造成)，返回截掉的字节数"""
+
+    if not os.path.exists(file):
+        return 0
+    size = os.path.getsize(file)
+    if size < HEADER_SIZE:    # 文件头不完整，视为空文件
+        valid = 0
+    else:
+        valid = HEADER_SIZE + (size - HEADER_SIZE) // RECORD_SIZE * RECORD_SIZE
+    if valid < size:
+        with open(file, "r+b") as f:
+            f.truncate(valid)
+    return size - valid
+
+
+class CandleWriter:
+    """批量追加K线的写入服务
+
+    保持文件句柄打开，各币种的新数据先缓存在内存中，每interval秒 (或调用`flush`时) 统一写入并fsync；
+    首次写入某个文件时截掉末尾不完整的记录，并按开盘时间去重 (不早于文件中已有的最后一条)
+    """
+
+    def __init__(self, interval=1.0, fsync=True, max_open=512):
+        self.interval = interval
+        self.fsync = fsync
+        self.max_open = max_open    # 同时打开的文件数上限
+        self.handles = {}    # file -> 文件句柄
+        self.pending = {}    # file -> 待写入的结构化数组列表
+        self.last_times = {}    # file -> 已写入 (含待写入) 的最后一条开盘时间
+        self.last_flush_tic = time.time()
+
+    def _last_time(self, file):
+        if file not in self.last_times:
+            repair(file)
+            last = last_timestamp(file)
+            self.last_times[file] = -1 if last is None else last
+        return self.last_times[file]
+
+    def append(self, file, rows):
+        """缓存K线数据，丢弃已写入过的开盘时间，到达写入间隔时自动写入"""
+
+        records = rows if isinstance(rows, np.ndarray) else to_records(rows)
+        records = records[records["open_time"] > self._last_time(file)]
+        if len(records):
+            records = records[np.unique(records["open_time"], return_index=True)[1]]    # 同批次内去重并排序
+            self.pending.setdefault(file, []).append(records)
+            self.last_times[file] = int(records["open_time"][-1])
+        if time.time() - self.last_flush_tic >= self.interval:
+            self.flush()
+
+    def _handle(self, file):
+        if file not in self.handles:
+            if len(self.handles) >= self.max_open:
+                self.close_handles()
+            f = open(file, "ab")
+            if f.tell() == 0:
+                write_header(f)
+            self.handles[file] = f
+        return self.handles[file]
+
+    def flush(self):
+        """写入所有缓存数据并落盘"""
+
+        for file, chunks in self.pending.items():
+            f = self._handle(file)
+            for records in chunks:
+                f.write(records.astype(RECORD_DTYPE, copy=False).tobytes())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.pending = {}
+        self.last_flush_tic = time.time()
+
+    def close_handles(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+
+    def close(self):
+        self.flush()
+        self.close_handles()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def convert(src, dst, chunk_rows=100000, verbosity=1):
+    """将旧版TSV数据文件 (data/<SYMBOL>.1m.data) 转换为二进制格式"""
+
+    if verbosity:
+        print("转换`%s` -> `%s`..." % (src, dst))
+    tmp = dst + ".tmp"
+    n = 0
+    with open(src, encoding="utf-8") as fin, open(tmp, "wb") as fout:
+        write_header(fout)
+        rows = []
+        for line in fin:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            rows.append(line.split("\t"))
+            if len(rows) >= chunk_rows:
+                fout.write(to_records(rows).tobytes())
+                n += len(rows)
+                rows = []
+        if rows:
+            fout.write(to_records(rows).tobytes())
+            n += len(rows)
+    os.replace(tmp, dst)
+    return n
+
+
+def convert_all(path="data", verbosity=1):
+    """转换目录下所有旧版TSV数据文件，已转换的跳过"""
+
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".data"):
+            continue
+        src = os.path.join(path, name)
+        dst = src[:-len(".data")] + SUFFIX
+        if os.path.exists(dst):
+            continue
+        convert(src, dst, verbosity=verbosity)
+
+
+if __name__ == "__main__":
+    convert_all()
@@ -2,9 +2,13 @@
 
 import os
 import time
+import numpy as np
 from binance import instance
 
+import candle_store
+import rolling
 import utils
+from planner import PagePlanner
 
 
 # 币安所有已上线币种 (不包括稳定币/看涨币/看跌币等币种，顺序不定)
@@ -23,17 +27,47 @@ YEAR = 60 * 24 * 365
 TIMESTAMP_UNIT = 1000
 
 
+writer = candle_store.CandleWriter()    # 所有数据文件共用的写入服务 (批量写入，定期落盘)
+
+
+def get_data_file(symbol, interval="1m"):
+    """数据文件路径 (二进制格式)"""
+    return "data/%s.%s%s" % (symbol, interval, candle_store.SUFFIX)
+
+
 class Data:
-    """读取数据文件，生成数据结构体"""
+    """读取数据文件，生成数据结构体
+
+    二进制文件以内存映射方式读取，tics/prices/volumes为零拷贝的列视图；
+    旧版TSV文件逐行解析，指定start时借助按天偏移索引 (见`get_day_index`) 直接定位
+    start/end: 只读取 start <= 时间戳 < end 的数据 (毫秒)，默认不限
+    """
 
-    def __init__(self, file):
+    def __init__(self, file, start=None, end=None):
 
         print("从`%s`读取数据..." % file)
+        if candle_store.is_store(file):
+            records = candle_store.load(file)
+            i, j = 0, len(records)
+            if start is not None or end is not None:
+                tics = records["open_time"]
+                if start is not None:
+                    i = np.searchsorted(tics, start, side="left")
+                if end is not None:
+                    j = np.searchsorted(tics, end, side="left")
+            records = records[i:j]
+            self.tics = records["open_time"]
+            self.prices = records["close"]
+            self.volumes = records["quote_volume"]
+            return
+
         tics = []
         prices = []
         volumes = []
 
-        with open(file) as f:
+        with open(file, encoding="utf-8") as f:
+            if start is not None:
+                f.seek(seek_day(file, start))
             for line in f:
                 line = line[:-1].split("\t")
 
@@ -51,6 +85,10 @@ class Data:
                 # 10: "583235.27944325",    主动买入成交额
                 # 11: "0" ]                 请忽略该参数
                 tic = int(line[0])
+                if start is not None and tic < start:
+                    continue
+                if end is not None and tic >= end:
+                    break
                 price = float(line[4])
                 volume = float(line[7])
 
@@ -58,9 +96,9 @@ class Data:
                 prices.append(price)
                 volumes.append(volume)
 
-        self.tics = tics
-        self.prices = prices
-        self.volumes = volumes
+        self.tics = np.array(tics, dtype=np.int64)
+        self.prices = np.array(prices, dtype=np.float64)
+        self.volumes = np.array(volumes, dtype=np.float64)
 
 
 def get_moving_average(prices, interval):
@@ -69,79 +107,72 @@ def get_moving_average(prices, interval):
     prices: e.g. [121 123 125 124 120]
     target_prices: 头部不满足长度要求的为None，其余皆有值 e.g. [None, None, 123, 124, 123]
     """
-    # print("计算%s滑动平均价" % interval)
-
-    # 单位数据量
-    unit = int(interval[:-1])
-    if interval[-1] == "h":
-        unit *= 60
-    elif interval[-1] == "d":
-        unit *= 60 * 24
-
-    mean_price = 0
-    target_prices = []
-    for i in range(len(prices)):
-        if i < unit - 1:    # 未达数量要求
-            mean_price += prices[i] / unit
-            target_prices.append(None)
-        elif i == unit - 1:    # 刚达数量要求
-            mean_price += prices[i] / unit
-            target_prices.append(mean_price)
-        else:    # 达到数量要求
-            mean_price -= prices[i - unit] / unit    # 丢弃头
-            mean_price += prices[i] / unit    # 添加尾
-            target_prices.append(mean_price)
-    return target_prices
-
-
-def update_data_all(verbosity=1):
-    """更新所有数据"""
 
-    utils.mkdir("data")
+    unit = rolling.parse_window(interval)
+    ma = rolling.moving_averages(prices, [interval])[interval]
+    return [None] * min(unit - 1, len(ma)) + ma[unit - 1:].tolist()
 
-    # 遍历所有目标币种，以分钟为单位读取和更新数据
-    for i, coin in enumerate(COINS):
-        if verbosity:
-            print("%s (%d/%d)" % (coin, i + 1, len(COINS)))
-        data_loader(coin, "1m", "data/%s.1m.data" % coin, verbosity)
+
+def update_data_all(verbosity=1, workers=16, base_url=None):
+    """更新所有数据 (多币种、多时间段并发下载，中断后可续传)
+
+    base_url: 接口地址，默认与`binance.instance`一致
+    """
+
+    import asyncio
+    import backfill    # backfill依赖本模块，延迟导入避免循环引用
+
+    utils.mkdir("data")
+    asyncio.run(backfill.Backfill(COINS, workers=workers, verbosity=verbosity, base_url=base_url or instance.base_url).run())
 
 
 def data_loader(symbol, interval, file, verbosity=1):
     """加载新币种，或更新新数据"""
 
-    # 新文件从七天前开始取数据，已有文件则继续累积数据
-    last_timestamp = get_last_timestamp(file)
-    if last_timestamp:
-        init_timestamp = last_timestamp + 60 * TIMESTAMP_UNIT
-    else:
-        init_timestamp = int(time.time() - 7 * 24 * 60 * 60) * TIMESTAMP_UNIT
-
     # 获取最新数据
+    init_timestamp = get_init_timestamp(file, verbosity)
     latest_data = get_latest_data(symbol, interval, init_timestamp, verbosity)
     if not isinstance(latest_data, list):
         raise ValueError("download data fail: %s" % symbol)
-    with open(file, "a", encoding="utf-8") as f:
-        for item in latest_data:
-            f.write("%s\n" % "\t".join(list(map(str, item))))
+    writer.append(file, latest_data)
+    writer.flush()
+
+
+def convert_legacy(file, verbosity=1):
+    """旧版TSV文件存在时先转换为二进制格式，避免重新下载"""
+
+    legacy_file = file[:-len(candle_store.SUFFIX)] + ".data"
+    if candle_store.is_store(file) and not os.path.exists(file) and os.path.exists(legacy_file):
+        candle_store.convert(legacy_file, file, verbosity=verbosity)
+
+
+def get_init_timestamp(file, verbosity=1):
+    """新文件从七天前 (按分钟对齐，再早一分钟) 开始取数据，已有文件则继续累积数据
+
+    只保存已收线的K线时，新文件也能得到完整7天 (`DAY * 7`条) 的数据
+    """
+
+    convert_legacy(file, verbosity)
+    last_timestamp = get_last_timestamp(file)
+    if last_timestamp:
+        return last_timestamp + 60 * TIMESTAMP_UNIT
+    return (int(time.time()) // 60 * 60 - 7 * 24 * 60 * 60 - 60) * TIMESTAMP_UNIT
 
 
 def get_latest_data(symbol, interval, init_timestamp, verbosity=1):
-    """获得最新的区间数据"""
+    """获得最新的区间数据 (每页取满1000条，根据实际返回的数据推进下一页)"""
 
-    # 根据间隔计算时间戳区间
-    if interval == "1m":
-        timestamp_interval = 500 * 60 * TIMESTAMP_UNIT  # 500条，每条间隔1分钟
-    else:
-        raise ValueError("unsupported interval: %s", interval)
+    if interval != "1m":
+        raise ValueError("unsupported interval: %s" % interval)
 
     last = -1
-    start_timestamp = init_timestamp
     now_timestamp = int(time.time() * TIMESTAMP_UNIT)  # 现在
     if now_timestamp < init_timestamp + 60 + TIMESTAMP_UNIT:    # 时间太近
         return []
+    pages = PagePlanner(init_timestamp)
     latest_data = []
 
-    while True:
+    while not pages.done:
         now = time.time()
 
         # 睡眠，避免频繁请求
@@ -150,51 +181,116 @@ def get_latest_data(symbol, interval, init_timestamp, verbosity=1):
             continue
 
         # 获取数据
-        end_timestamp = start_timestamp + timestamp_interval - 1
-        data = instance.get_prices(symbol, interval, start_timestamp, end_timestamp)
+        start_timestamp, limit = pages.next_page()
+        data = instance.get_prices(symbol, interval, start_timestamp, limit=limit)
         if isinstance(data, dict) and "code" in data:
-            raise ValueError(data["%s" % data])
+            raise ValueError("%s" % data)
         elif data is None:    # 网络问题等造成失败，重试
             continue
-        latest_data += data
+        latest_data += pages.feed(data)
+        last = time.time()
 
         # 计算并打印当前进度
-        process = (start_timestamp + timestamp_interval - init_timestamp) / (now_timestamp - init_timestamp) * 100
-        process = min(process, 100)
-        if process < 0:
-            process = 100
+        process = 100 if pages.done else (pages.start - init_timestamp) / (now_timestamp - init_timestamp) * 100
         if verbosity:
-            print("[%.2f%%]" % process)
-
-        # 进入下一次批数据
-        last = time.time()
-        start_timestamp += timestamp_interval
-        if start_timestamp > now_timestamp:    # 结束
-            break
+            print("[%.2f%%]" % min(max(process, 0), 100))
 
     return latest_data
 
 
 def get_last_timestamp(file):
-    """从已有数据中获取最后一次记录的时间戳"""
+    """从已有数据中获取最后一次记录的时间戳 (只读取文件末尾)"""
 
+    if candle_store.is_store(file):
+        return candle_store.last_timestamp(file)
     if not os.path.exists(file):
         return None
 
-    # 读取最后一行
-    last_line = ""
-    with open(file, encoding="utf-8") as f:
-        while True:
-            line = f.readline()
-            if not line:
-                break
-            last_line = line
-
     # 最后一行的第一个元素，即为时间戳
+    last_line = read_last_line(file)
     if last_line:
-        return int(last_line.strip().split("\t")[0])
+        return int(last_line.split(b"\t")[0])
     return None
 
 
+def read_last_line(file, block_size=4096):
+    """从文件末尾向前按块查找，返回最后一个非空行 (bytes)，与文件大小无关"""
+
+    with open(file, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            tail = f.read(size) + tail
+            stripped = tail.rstrip(b"\r\n")
+            index = stripped.rfind(b"\n")
+            if index >= 0:
+                return stripped[index + 1:]
+        return tail.rstrip(b"\r\n") or None
+
+
+def get_index_file(file):
+    """旧版TSV文件的按天偏移索引文件路径"""
+    return file + ".idx"
+
+
+def get_day_index(file):
+    """旧版TSV文件的按天偏移索引，保存在`<file>.idx`，文件增长后增量更新
+
+    索引文件第一行为已索引的文件字节数，其后每行为 "当天0点时间戳 (UTC)\t当天第一行的字节偏移"
+    returns: (days, offsets)，均为按时间递增的数组
+    """
+
+    index_file = get_index_file(file)
+    day_unit = DAY * 60 * TIMESTAMP_UNIT
+    size = os.path.getsize(file)
+    indexed = 0
+    days = []
+    offsets = []
+    if os.path.exists(index_file):
+        with open(index_file, encoding="utf-8") as f:
+            indexed = int(f.readline())
+            for line in f:
+                day, offset = line.split("\t")
+                days.append(int(day))
+                offsets.append(int(offset))
+        if indexed > size:    # 文件被重写，重新建立索引
+            indexed, days, offsets = 0, [], []
+
+    if indexed < size:
+        with open(file, "rb") as f:
+            f.seek(indexed)
+            offset = indexed
+            for line in f:
+                if not line.endswith(b"\n"):    # 末尾不完整的行留待下次索引
+                    break
+                day = int(line[:line.index(b"\t")]) // day_unit * day_unit
+                if not days or day > days[-1]:
+                    days.append(day)
+                    offsets.append(offset)
+                offset += len(line)
+            indexed = offset
+
+        temp_file = index_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("%d\n" % indexed)
+            for day, offset in zip(days, offsets):
+                f.write("%d\t%d\n" % (day, offset))
+        os.replace(temp_file, index_file)
+
+    return np.array(days, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def seek_day(file, timestamp):
+    """旧版TSV文件中timestamp所在当天第一行的字节偏移 (早于第一天时为0)"""
+
+    days, offsets = get_day_index(file)
+    i = np.searchsorted(days, timestamp, side="right") - 1
+    return int(offsets[i]) if i >= 0 else 0
+
+
 if __name__ == "__main__":
     update_data_all()
@@ -0,0 +1,312 @@
+# 多币种向量化监控引擎：所有币种的价量保存在同一个矩阵中 (币种 x 分钟)，每分钟批量执行监控规则
+
+import os
+import json
+import time
+import contextlib
+import numpy as np
+
+import data_loader
+import metrics
+from alerts import Alert, AlertDispatcher, ConsoleSink
+from rolling import RollingMean, parse_window
+from rules import Context, RuleSet
+
+
+class MonitorEngine:
+    """多币种监控引擎，告警规则见`rules.json`
+
+    每个币种占矩阵的一行，各行独立维护环形写入位置 (heads)，因此不要求所有币种同时到达新数据
+    """
+
+    def __init__(
+        self,
+        symbols,                                # 资产名称列表
+        capacity=data_loader.DAY * 7,           # 每个币种保留的分钟数
+        rules=None,                             # 告警规则 (`rules.RuleSet`)，默认读取`rules.json`
+        dispatcher=None,                        # 告警分发器，默认只输出到控制台
+    ):
+        self.symbols = list(symbols)
+        self.rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.capacity = capacity
+        self.rules = (rules if rules is not None else RuleSet.load()).bind(self.symbols)
+        self.dispatcher = dispatcher or AlertDispatcher([ConsoleSink()])
+
+        n = len(self.symbols)
+        self.tics = np.zeros((n, capacity), dtype=np.int64)
+        self.prices = np.zeros((n, capacity), dtype=np.float64)
+        self.volumes = np.zeros((n, capacity), dtype=np.float64)
+        self.heads = np.zeros(n, dtype=np.int64)    # 每行下一个写入位置
+
+        # 规则用到的滑动平均 (如7分钟/7小时/7日均价) 增量维护
+        self.ma = {
+            series: RollingMean(n, units)
+            for series, units in self.rules.moving_averages().items() if units
+        }
+
+        self.active = np.ones(n, dtype=bool)    # 执行监控规则的币种 (其余只更新数据，见`universe.Universe`)
+        self.last_alarm = np.zeros(n, dtype=np.int8)    # 上一次提示内容 (0: 无, 1: 上涨, -1: 下跌)
+        self.last_alarm_tic = np.full(n, -1.0)    # 上一次提示时间戳 (避免同一条信息重复提醒)
+        self.shared = None    # 共享内存中的价量矩阵 (见`share`)
+
+    def share(self, shared):
+        """将价量矩阵移入共享内存 (`shared_candles.SharedCandles`)，供同一台机器上的其他进程零拷贝读取"""
+
+        with shared.writing():
+            shared.tics[:] = self.tics
+            shared.prices[:] = self.prices
+            shared.volumes[:] = self.volumes
+            shared.heads[:] = self.heads
+        self.tics, self.prices, self.volumes, self.heads = shared.tics, shared.prices, shared.volumes, shared.heads
+        self.shared = shared
+
+    def writing(self):
+        """修改价量矩阵期间更新共享内存的版本号，读取方据此判断数据是否一致"""
+        return self.shared.writing() if self.shared is not None else contextlib.nullcontext()
+
+    def matrix(self, series):
+        return self.prices if series == "price" else self.volumes
+
+    def load(self, symbol, tics, prices, volumes):
+        """载入历史数据 (长度需不少于capacity)，并初始化滑动平均"""
+
+        row = self.rows[symbol]
+        with self.writing():
+            self.tics[row] = tics[-self.capacity:]
+            self.prices[row] = prices[-self.capacity:]
+            self.volumes[row] = volumes[-self.capacity:]
+            self.heads[row] = 0
+        for series, ma in self.ma.items():
+            ma.reset([row], self.matrix(series)[[row]])
+
+    def moving_average(self, series, interval):
+        """所有币种在指定窗口的滑动平均"""
+
+        unit = parse_window(interval)
+        ma = self.ma.get(series)
+        if ma is not None and unit in ma.units:
+            return ma.mean(unit)
+        return self.window(self.matrix(series), np.arange(len(self.symbols)), unit).mean(axis=1)
+
+    def _columns(self, rows, k):
+        """rows对应的倒数第k个元素所在列"""
+        return (self.heads[rows] - k) % self.capacity
+
+    def last(self, matrix, rows=None, k=1):
+        """获取rows (默认全部) 的倒数第k个元素"""
+        if rows is None:
+            rows = np.arange(len(self.symbols))
+        return matrix[rows, self._columns(rows, k)]
+
+    def window(self, matrix, rows, size=None):
+        """按时间顺序获取rows最近size (默认capacity) 分钟的数据"""
+        size = size or self.capacity
+        columns = (self.heads[rows, None] - size + np.arange(size)) % self.capacity
+        return matrix[np.asarray(rows)[:, None], columns]
+
+    def update(self, rows, tic, prices, volumes):
+        """批量写入rows的最新一分钟数据"""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        values = {"price": prices, "volume": volumes}
+        for series, ma in self.ma.items():
+            matrix = self.matrix(series)
+            ma.update(rows, values[series], {unit: self.last(matrix, rows, unit) for unit in ma.units})
+
+        columns = self.heads[rows]
+        with self.writing():
+            self.tics[rows, columns] = tic
+            self.prices[rows, columns] = prices
+            self.volumes[rows, columns] = volumes
+            self.heads[rows] = (columns + 1) % self.capacity
+
+        # 定期用原始窗口精确重算滑动和
+        for series, ma in self.ma.items():
+            stale = ma.need_resync(rows)
+            if len(stale):
+                ma.reset(stale, self.window(self.matrix(series), stale))
+
+    def revise(self, row, tics, prices, volumes):
+        """用同一时间的新数据替换row中已写入的K线 (如用已收线的K线替换临时K线)，同时修正滑动平均
+
+        不在窗口中的时间忽略
+        returns: 替换的条数
+        """
+
+        tics = np.asarray(tics, dtype=np.int64)
+        history = self.window(self.tics, [row])[0]    # 按时间顺序
+        positions = np.searchsorted(history, tics)
+        found = positions < self.capacity
+        found[found] = history[positions[found]] == tics[found]
+        ages = self.capacity - positions[found]    # 1为最新值
+        columns = (self.heads[row] - ages) % self.capacity
+
+        values = {
+            "price": np.asarray(prices, dtype=np.float64)[found],
+            "volume": np.asarray(volumes, dtype=np.float64)[found],
+        }
+        for series, ma in self.ma.items():
+            ma.adjust(row, values[series] - self.matrix(series)[row, columns], ages)
+        with self.writing():
+            self.prices[row, columns] = values["price"]
+            self.volumes[row, columns] = values["volume"]
+        return int(found.sum())
+
+    def candidates(self, rows):
+        """rows中监控范围内满足任一规则条件的币种 (不考虑同类提示抑制，不发出告警)"""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[self.active[rows]]
+        if len(rows) == 0:
+            return rows
+
+        context = Context(self, rows)
+        hits = np.zeros(len(rows), dtype=bool)
+        for rule in self.rules:
+            candidates = rule.mask[rows] & ~hits
+            if not candidates.any():
+                continue
+            hits |= rule.evaluate(context)[0] & candidates
+        return rows[hits]
+
+    def execute(self, rows, now=None):
+        """对rows中监控范围内的币种按顺序批量执行各条规则，同类提示在规则设定的间隔内最多一次"""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[self.active[rows]]
+        if len(rows) == 0:
+            return
+        if now is None:
+            now = time.time()
+
+        context = Context(self, rows)
+        blocked = np.zeros(len(rows), dtype=bool)    # 已被前面的规则触发的币种
+        for rule in self.rules:
+            candidates = rule.mask[rows] & ~blocked
+            if not candidates.any():
+                continue
+            hits, first = rule.evaluate(context)
+            hits &= candidates
+            if rule.exclusive:
+                blocked |= hits
+
+            # 同类提示抑制
+            expired = now - self.last_alarm_tic[rows] > rule.repeat_after
+            if rule.repeat_if is not None:
+                expired &= rule.repeat_if(context)
+            for j in np.flatnonzero(hits & ((self.last_alarm[rows] != rule.alarm) | expired)):
+                row = rows[j]
+                metrics.registry.inc("alerts_total", rule=rule.name)
+                self.dispatcher.publish(Alert(
+                    int(self.last(self.tics, [row])[0]),
+                    self.symbols[row],
+                    float(context.latest("price")[j]),
+                    rule.name,
+                    rule.alarm,
+                    rule.format(context, j, first),
+                    color=rule.color,
+                    sound=rule.sound,
+                ))
+                self.last_alarm[row] = rule.alarm
+                self.last_alarm_tic[row] = now
+
+    def feed(self, bars):
+        """按分钟对齐批量更新并执行监控
+
+        bars: {symbol: [kline, ...]}，kline为`/klines`返回的原始格式
+        """
+
+        with metrics.registry.timer("monitor_stage_seconds", stage="parse"):
+            by_tic = {}
+            for symbol, items in bars.items():
+                row = self.rows[symbol]
+                for item in items:
+                    by_tic.setdefault(int(item[0]), []).append((row, float(item[4]), float(item[7])))
+
+        for tic in sorted(by_tic):
+            rows, prices, volumes = zip(*by_tic[tic])
+            rows = np.array(rows, dtype=np.int64)
+            with metrics.registry.timer("monitor_stage_seconds", stage="update"):
+                self.update(rows, tic, np.array(prices), np.array(volumes))
+            with metrics.registry.timer("monitor_stage_seconds", stage="execute"):
+                self.execute(rows)
+
+    def replay(self, histories):
+        """追赶快照之后的新数据 (只更新状态，不执行监控)
+
+        histories: {symbol: (tics, prices, volumes)}，按时间顺序的完整历史 (如内存映射的数据文件)
+        returns: 追赶的K线条数
+        """
+
+        by_tic = {}
+        n = 0
+        for symbol, (tics, prices, volumes) in histories.items():
+            row = self.rows[symbol]
+            start = np.searchsorted(tics, self.last(self.tics, [row])[0], side="right")
+            if len(tics) - start >= self.capacity:    # 快照过旧，直接重新载入
+                self.load(symbol, tics, prices, volumes)
+                continue
+            for i in range(start, len(tics)):
+                by_tic.setdefault(int(tics[i]), []).append((row, float(prices[i]), float(volumes[i])))
+            n += len(tics) - start
+
+        for tic in sorted(by_tic):
+            rows, prices, volumes = zip(*by_tic[tic])
+            self.update(np.array(rows, dtype=np.int64), tic, np.array(prices), np.array(volumes))
+        return n
+
+    def save(self, file, **meta):
+        """保存状态快照 (.npz)，先写临时文件再原子替换
+
+        meta: 附加信息 (如币种筛选参数)，恢复时原样返回
+        """
+
+        state = {
+            "symbols": np.array(self.symbols),
+            "tics": self.tics,
+            "prices": self.prices,
+            "volumes": self.volumes,
+            "heads": self.heads,
+            "last_alarm": self.last_alarm,
+            "last_alarm_tic": self.last_alarm_tic,
+            "meta": np.array(json.dumps(meta)),
+        }
+        for series, ma in self.ma.items():
+            state["ma_%s_units" % series] = np.array(ma.units)
+            state["ma_%s_sums" % series] = ma.sums
+            state["ma_%s_compensations" % series] = ma.compensations
+            state["ma_%s_updates" % series] = ma.updates
+
+        temp_file = "%s.tmp" % file
+        with open(temp_file, "wb") as f:
+            np.savez(f, **state)
+        os.replace(temp_file, file)
+
+    @classmethod
+    def restore(cls, file, rules=None, dispatcher=None):
+        """从快照恢复引擎
+
+        滑动和与当前规则用到的窗口一致时直接恢复，否则由快照中的原始窗口重新计算
+        returns: (engine, meta)
+        """
+
+        with np.load(file) as state:
+            tics = state["tics"]
+            engine = cls(state["symbols"].tolist(), tics.shape[1], rules=rules, dispatcher=dispatcher)
+            engine.tics[:] = tics
+            engine.prices[:] = state["prices"]
+            engine.volumes[:] = state["volumes"]
+            engine.heads[:] = state["heads"]
+            engine.last_alarm[:] = state["last_alarm"]
+            engine.last_alarm_tic[:] = state["last_alarm_tic"]
+            rows = np.arange(len(engine.symbols))
+            for series, ma in engine.ma.items():
+                key = "ma_%s_units" % series
+                if key in state and state[key].tolist() == ma.units:
+                    ma.sums[:] = state["ma_%s_sums" % series]
+                    ma.compensations[:] = state["ma_%s_compensations" % series]
+                    ma.updates[:] = state["ma_%s_updates" % series]
+                else:
+                    ma.reset(rows, engine.window(engine.matrix(series), rows))
+            meta = json.loads(state["meta"].item())
+        return engine, meta
@@ -0,0 +1,215 @@
+# 运行指标：计数器、耗时直方图与回调式指标，通过本地HTTP接口以Prometheus文本格式输出，也可定期打印摘要
+#
+# 各模块直接使用模块级的`registry`记录指标，例如：
+#   with metrics.registry.timer("monitor_stage_seconds", stage="fetch"):
+#       ...
+#   metrics.registry.inc("binance_requests_total", path="/klines", status=200)
+#
+# curl http://127.0.0.1:9108/metrics
+
+import time
+import bisect
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PORT = 9108
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)    # 秒
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, value) for key, value in items)
+
+
+class Histogram:
+    """固定分桶的直方图，observe为O(log 桶数)"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # 最后一个为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """分位数的近似值 (所在桶的上界)"""
+
+        target = q * self.count
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bucket
+        return float("inf")
+
+
+class Registry:
+    """指标集合"""
+
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> 值
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.gauges = {}    # name -> 回调，返回 {labels: 值} 或单个值
+        self.descriptions = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """记录代码块的耗时 (秒)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, fn, description=None):
+        """注册回调式指标，输出时调用fn获取当前值
+
+        fn: 返回单个值，或 {(("label", "value"), ...): 值}
+        """
+        self.gauges[name] = fn
+        if description:
+            self.describe(name, description)
+
+    def _gauge_values(self, fn):
+        try:
+            values = fn()
+        except Exception as e:
+            print("FAIL: metrics gauge: %s" % e)
+            return {}
+        if isinstance(values, dict):
+            return values
+        return {(): values}
+
+    def render(self):
+        """Prometheus文本格式"""
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = [
+                (key, list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)
+                for key, histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+            ]
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self.descriptions:
+                lines.append("# HELP %s %s" % (name, self.descriptions[name]))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append("%s%s %s" % (name, _format_labels(labels), value))
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bucket, n in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (name, _format_labels(labels, [("le", bucket)]), cumulative))
+            lines.append("%s_sum%s %.6f" % (name, _format_labels(labels), total))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels), count))
+        for name, fn in sorted(self.gauges.items()):
+            header(name, "gauge")
+            for labels, value in sorted(self._gauge_values(fn).items()):
+                lines.append("%s%s %s" % (name, _format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """各耗时指标的次数/均值/P50/P99及计数器的简要汇总"""
+
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            counters = sorted(self.counters.items())
+        lines = []
+        for (name, labels), histogram in histograms:
+            if histogram.count == 0:
+                continue
+            lines.append("%s%s: %d次, 均值%.1fms, P50<=%sms, P99<=%sms" % (
+                name,
+                _format_labels(labels),
+                histogram.count,
+                histogram.sum / histogram.count * 1000,
+                "%g" % (histogram.quantile(0.5) * 1000),
+                "%g" % (histogram.quantile(0.99) * 1000),
+            ))
+        for (name, labels), value in counters:
+            lines.append("%s%s: %s" % (name, _format_labels(labels), value))
+        return "\n".join(lines)
+
+
+registry = Registry()    # 全局默认的指标集合
+
+
+class PeriodicLog:
+    """每interval秒打印一次指标摘要"""
+
+    def __init__(self, registry=registry, interval=600):
+        self.registry = registry
+        self.interval = interval
+        self.last_log_tic = time.time()
+
+    def update(self):
+        if time.time() - self.last_log_tic <= self.interval:
+            return
+        print("---------- 运行指标 ----------\n%s" % self.registry.summary())
+        self.last_log_tic = time.time()
+
+
+def start_server(registry=registry, port=PORT, host="127.0.0.1"):
+    """在后台线程中启动HTTP服务，GET /metrics 返回Prometheus文本格式的指标"""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):    # 不打印访问日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
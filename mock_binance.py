@@ -0,0 +1,346 @@
+# 本地模拟的币安行情接口，用于离线测试与压测 (并发、限流处理、异常重试等)
+#
+# 实现 /klines, /ticker/price, /ticker/bookTicker, /ticker/24hr, /time, /ping，数据来源为合成K线或已下载的数据文件；
+# 可配置响应延迟、错误率，按请求权重计数并返回 X-MBX-USED-WEIGHT-1M，超出限额时返回429，继续请求则返回418
+#
+# python3 mock_binance.py --symbols 300 --latency 0.05 --error-rate 0.01
+# python3 monitor.py --api-url http://127.0.0.1:18080/api/v3
+
+import os
+import glob
+import json
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+from aiohttp import web
+
+import candle_store
+from bench.generator import generate_klines
+
+
+PORT = 18080
+KLINES_LIMIT = 1000
+DAY = 24 * 60 * 60 * 1000    # 毫秒
+WEIGHTS = {    # 请求权重 (单币种, 全部币种)
+    "klines": (2, 2),
+    "ticker/price": (1, 2),
+    "ticker/bookTicker": (1, 2),
+    "ticker/24hr": (1, 80),    # 与`AsyncBinanceAPI.TICKERS_WEIGHT`一致
+    "time": (1, 1),
+    "ping": (1, 1),
+}
+
+
+def _format(value):
+    return "%.8f" % value
+
+
+def record_to_kline(record, offset=0):
+    """结构化记录 -> `/klines`返回的格式"""
+
+    return [
+        int(record["open_time"]) + offset,
+        _format(record["open"]),
+        _format(record["high"]),
+        _format(record["low"]),
+        _format(record["close"]),
+        _format(record["volume"]),
+        int(record["close_time"]) + offset,
+        _format(record["quote_volume"]),
+        int(record["trades"]),
+        _format(record["taker_base_volume"]),
+        _format(record["taker_quote_volume"]),
+        "0",
+    ]
+
+
+class MockBinance:
+    """模拟的币安行情服务
+
+    symbols: 合成数据的币种列表
+    days: 合成数据从多少天前开始 (之后一天的数据也预先生成，随时间推移逐分钟可见)
+    latency: 平均响应延迟 (秒)，实际延迟在 [0.5, 1.5] 倍之间均匀分布
+    error_rate: 返回500错误的概率
+    weight_limit: 每分钟的请求权重上限，超出后返回429，被限流期间继续请求超过ban_after次则返回418
+    """
+
+    def __init__(
+        self,
+        symbols=(),
+        days=8,
+        latency=0.0,
+        error_rate=0.0,
+        weight_limit=1200,
+        ban_after=10,
+        ban_seconds=120,
+        seed=0,
+        verbosity=1,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.weight_limit = weight_limit
+        self.ban_after = ban_after
+        self.ban_seconds = ban_seconds
+        self.random = random.Random(seed)
+        self.verbosity = verbosity
+
+        now_minute = int(time.time() * 1000) // 60000 * 60000
+        self.start_timestamp = now_minute - days * DAY
+        self.minutes = (days + 1) * 24 * 60
+        self.seed = seed
+        self.records = {symbol: None for symbol in symbols}    # 合成数据首次请求时生成
+        self.offsets = {}    # 录制数据的时间偏移 (毫秒)
+
+        self.weight_minute = -1
+        self.used_weight = 0
+        self.rejected = 0    # 被限流期间的请求数
+        self.banned_until = 0
+        self.stats = {"requests": 0, "errors": 0, "429": 0, "418": 0}
+
+    @classmethod
+    def from_store(cls, path="data", shift=True, **kwargs):
+        """使用已下载的数据文件 (`<path>/<SYMBOL>.1m.bin`)
+
+        shift: 将时间整体平移，使最后一条K线恰好在当前分钟之前收线
+        """
+
+        server = cls(**kwargs)
+        now_minute = int(time.time() * 1000) // 60000 * 60000
+        for file in sorted(glob.glob(os.path.join(path, "*.1m%s" % candle_store.SUFFIX))):
+            records = candle_store.load(file)
+            if len(records) == 0:
+                continue
+            symbol = os.path.basename(file).split(".")[0]
+            server.records[symbol] = records
+            server.offsets[symbol] = now_minute - 60000 - int(records["open_time"][-1]) if shift else 0
+        return server
+
+    def get_records(self, symbol):
+        """returns: (symbol的全部K线, 时间偏移)，不存在的币种K线为None"""
+
+        if symbol not in self.records:
+            return None, 0
+        if self.records[symbol] is None:
+            seed = self.seed * 100003 + sum(ord(c) for c in symbol) * 131 + len(symbol)
+            self.records[symbol] = generate_klines(self.minutes, seed=seed, start_timestamp=self.start_timestamp)
+        return self.records[symbol], self.offsets.get(symbol, 0)
+
+    def visible(self, symbol, now):
+        """截至now已开盘的K线 (最后一条可能尚未收线)"""
+
+        records, offset = self.get_records(symbol)
+        return records[:np.searchsorted(records["open_time"], now - offset, side="right")], offset
+
+    def _json(self, data, status=200, headers=None):
+        headers = dict(headers or {})
+        headers["X-MBX-USED-WEIGHT-1M"] = str(self.used_weight)
+        return web.json_response(data, status=status, headers=headers)
+
+    def _error(self, code, message, status=400):
+        return self._json({"code": code, "msg": message}, status=status)
+
+    async def _admit(self, endpoint, single):
+        """计算请求权重，模拟延迟/错误/限流；通过时返回None，否则返回错误响应"""
+
+        self.stats["requests"] += 1
+        now = time.time()
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+        if now < self.banned_until:
+            self.stats["418"] += 1
+            return self._json(
+                {"code": -1003, "msg": "Way too many requests; IP banned."},
+                status=418,
+                headers={"Retry-After": str(int(self.banned_until - now) + 1)},
+            )
+
+        minute = int(now // 60)
+        if minute != self.weight_minute:
+            self.weight_minute = minute
+            self.used_weight = 0
+            self.rejected = 0
+        weight = WEIGHTS[endpoint][0 if single else 1]
+        if self.used_weight + weight > self.weight_limit:
+            self.rejected += 1
+            if self.rejected > self.ban_after:
+                self.banned_until = now + self.ban_seconds
+                self.stats["418"] += 1
+                return self._json(
+                    {"code": -1003, "msg": "Way too many requests; IP banned."},
+                    status=418,
+                    headers={"Retry-After": str(self.ban_seconds)},
+                )
+            self.stats["429"] += 1
+            return self._json(
+                {"code": -1003, "msg": "Too much request weight used."},
+                status=429,
+                headers={"Retry-After": str(60 - int(now % 60))},
+            )
+        self.used_weight += weight
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return self._error(-1000, "An unknown error occured while processing the request.", status=500)
+        return None
+
+    async def ping(self, request):
+        rejected = await self._admit("ping", True)
+        return rejected if rejected is not None else self._json({})
+
+    async def server_time(self, request):
+        rejected = await self._admit("time", True)
+        return rejected if rejected is not None else self._json({"serverTime": int(time.time() * 1000)})
+
+    async def klines(self, request):
+        query = request.query
+        rejected = await self._admit("klines", True)
+        if rejected is not None:
+            return rejected
+        symbol = query.get("symbol")
+        if symbol not in self.records:
+            return self._error(-1121, "Invalid symbol.")
+        if query.get("interval") != "1m":
+            return self._error(-1120, "Invalid interval.")
+        try:
+            limit = min(int(query.get("limit", 500)), KLINES_LIMIT)
+            start = int(query["startTime"]) if "startTime" in query else None
+            end = int(query["endTime"]) if "endTime" in query else None
+        except ValueError as e:
+            return self._error(-1100, "Illegal characters found in parameter: %s" % e)
+
+        records, offset = self.visible(symbol, int(time.time() * 1000))
+        tics = records["open_time"]
+        j = len(records) if end is None else np.searchsorted(tics, end - offset, side="right")
+        if start is None:    # 未指定起始时间时返回最近的limit条
+            i = max(j - limit, 0)
+        else:
+            i = np.searchsorted(tics, start - offset, side="left")
+            j = min(j, i + limit)
+        return self._json([record_to_kline(record, offset) for record in records[i:j]])
+
+    def _symbols(self, request):
+        """请求的币种列表 (symbol / symbols 参数，缺省为全部)"""
+
+        if "symbol" in request.query:
+            return [request.query["symbol"]]
+        if "symbols" in request.query:
+            return json.loads(request.query["symbols"])
+        return list(self.records)
+
+    async def _ticker(self, request, endpoint, fn):
+        single = "symbol" in request.query
+        rejected = await self._admit(endpoint, single)
+        if rejected is not None:
+            return rejected
+        try:
+            symbols = self._symbols(request)
+        except ValueError:
+            return self._error(-1100, "Illegal characters found in parameter 'symbols'.")
+        now = int(time.time() * 1000)
+        items = []
+        for symbol in symbols:
+            if symbol not in self.records:
+                return self._error(-1121, "Invalid symbol.")
+            records, offset = self.visible(symbol, now)
+            if len(records):
+                items.append(fn(symbol, records, offset))
+        return self._json(items[0] if single and items else items)
+
+    async def ticker_price(self, request):
+        def fn(symbol, records, offset):
+            return {"symbol": symbol, "price": _format(records["close"][-1])}
+        return await self._ticker(request, "ticker/price", fn)
+
+    async def ticker_book(self, request):
+        def fn(symbol, records, offset):
+            price = records["close"][-1]
+            return {
+                "symbol": symbol,
+                "bidPrice": _format(price * 0.9999),
+                "bidQty": _format(records["volume"][-1] * 0.01),
+                "askPrice": _format(price * 1.0001),
+                "askQty": _format(records["volume"][-1] * 0.01),
+            }
+        return await self._ticker(request, "ticker/bookTicker", fn)
+
+    async def ticker_24hr(self, request):
+        def fn(symbol, records, offset):
+            day = records[-24 * 60:]
+            open_price, last_price = day["open"][0], day["close"][-1]
+            return {
+                "symbol": symbol,
+                "priceChange": _format(last_price - open_price),
+                "priceChangePercent": "%.3f" % ((last_price / open_price - 1) * 100),
+                "weightedAvgPrice": _format(day["quote_volume"].sum() / day["volume"].sum()),
+                "prevClosePrice": _format(records["close"][-len(day) - 1] if len(records) > len(day) else open_price),
+                "lastPrice": _format(last_price),
+                "bidPrice": _format(last_price * 0.9999),
+                "askPrice": _format(last_price * 1.0001),
+                "openPrice": _format(open_price),
+                "highPrice": _format(day["high"].max()),
+                "lowPrice": _format(day["low"].min()),
+                "volume": _format(day["volume"].sum()),
+                "quoteVolume": _format(day["quote_volume"].sum()),
+                "openTime": int(day["open_time"][0]) + offset,
+                "closeTime": int(day["close_time"][-1]) + offset,
+                "count": int(day["trades"].sum()),
+            }
+        return await self._ticker(request, "ticker/24hr", fn)
+
+    async def report(self, interval=10):
+        while True:
+            await asyncio.sleep(interval)
+            print("%d次请求, 权重%d/%d, 错误%d, 429: %d, 418: %d" % (
+                self.stats["requests"], self.used_weight, self.weight_limit,
+                self.stats["errors"], self.stats["429"], self.stats["418"],
+            ))
+
+    def app(self, prefix="/api/v3"):
+        app = web.Application()
+        app.router.add_get(prefix + "/ping", self.ping)
+        app.router.add_get(prefix + "/time", self.server_time)
+        app.router.add_get(prefix + "/klines", self.klines)
+        app.router.add_get(prefix + "/ticker/price", self.ticker_price)
+        app.router.add_get(prefix + "/ticker/bookTicker", self.ticker_book)
+        app.router.add_get(prefix + "/ticker/24hr", self.ticker_24hr)
+        return app
+
+    async def start(self, host="127.0.0.1", port=PORT):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        if self.verbosity:
+            print("模拟行情接口: http://%s:%d/api/v3 (%d个币种)" % (host, port, len(self.records)))
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="本地模拟的币安行情接口")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--symbols", type=int, default=300, help="合成数据的币种数 (取`data_loader.COINS`的前N个)")
+    parser.add_argument("--days", type=int, default=8, help="合成数据的天数")
+    parser.add_argument("--data", default=None, help="使用该目录下已下载的数据文件代替合成数据")
+    parser.add_argument("--latency", type=float, default=0.0, help="平均响应延迟 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500错误的概率")
+    parser.add_argument("--weight-limit", type=int, default=1200, help="每分钟的请求权重上限")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    options = dict(latency=args.latency, error_rate=args.error_rate, weight_limit=args.weight_limit, seed=args.seed)
+    if args.data:
+        server = MockBinance.from_store(args.data, **options)
+    else:
+        import data_loader    # 币种列表
+        server = MockBinance(data_loader.COINS[:args.symbols], args.days, **options)
+
+    async def main():
+        await server.start(port=args.port)
+        await server.report()
+
+    asyncio.run(main())
@@ -2,13 +2,26 @@
 
 import os
 import time
+import argparse
+import numpy as np
 import pygame
 
+import alerts
 import data_loader
+import metrics
+import shared_candles
 import utils
+from engine import MonitorEngine
+from ring_buffer import RingBuffer
+from rolling import RollingMean
+from rules import RuleSet
+from universe import Universe
+from scheduler import ServerClock, MinuteScheduler
+from tickers import TickerBars
 
 
 class Monitor:
+    """逐币种监控的参考实现，`bench/check.py`用其验证`engine.MonitorEngine`的提示一致"""
 
     def __init__(
         self,
@@ -19,32 +32,38 @@ class Monitor:
         volume_ratio=10,                        # 超出均交易额多大比例认为交易额突增
     ):
         self.symbol = symbol
-        self.tics = tics
-        self.prices = prices
-        self.volumes = volumes
+        self.tics = RingBuffer(len(tics), dtype=np.int64, values=tics)    # 定长窗口，push为O(1)
+        self.prices = RingBuffer(len(prices), values=prices)
+        self.volumes = RingBuffer(len(volumes), values=volumes)
         self.volume_ratio = volume_ratio
         self.last_alarm = None    # 上一次提示内容
         self.last_alarm_tic = -1    # 上一次提示时间戳 (避免同一条信息重复提醒)
 
-        self.ma_7m_price = data_loader.get_moving_average(prices, "7m")[-1]    # 7分钟滑动平均价
-        self.ma_7h_price = data_loader.get_moving_average(prices, "7h")[-1]    # 7小时滑动平均价
-        self.ma_7h_volume = data_loader.get_moving_average(volumes, "7h")[-1]    # 7日滑动平均交易额
-        self.ma_7d_price = data_loader.get_moving_average(prices, "7d")[-1]    # 7日滑动平均价
-        self.ma_7d_volume = data_loader.get_moving_average(volumes, "7d")[-1]    # 7日滑动平均交易额
+        self.price_ma = RollingMean(1, ["7m", "7h", "7d"])    # 7分钟/7小时/7日滑动平均价
+        self.volume_ma = RollingMean(1, ["7h", "7d"])    # 7小时/7日滑动平均交易额
+        self.price_ma.reset([0], [prices])
+        self.volume_ma.reset([0], [volumes])
+        self._update_ma()
+
+    def _update_ma(self):
+        self.ma_7m_price = self.price_ma.mean("7m")[0]    # 7分钟滑动平均价
+        self.ma_7h_price = self.price_ma.mean("7h")[0]    # 7小时滑动平均价
+        self.ma_7h_volume = self.volume_ma.mean("7h")[0]    # 7小时滑动平均交易额
+        self.ma_7d_price = self.price_ma.mean("7d")[0]    # 7日滑动平均价
+        self.ma_7d_volume = self.volume_ma.mean("7d")[0]    # 7日滑动平均交易额
 
     def update(self, tic, price, volume):
         """更新最新数据"""
-        self.ma_7m_price += price / 7 - self.prices[-7] / 7
-        self.ma_7h_price += price / 420 - self.prices[-420] / 420
-        self.ma_7h_volume += volume / 420 - self.volumes[-420] / 420
-        self.ma_7d_price += price / 10080 - self.prices[-10080] / 10080
-        self.ma_7d_volume += volume / 10080 - self.volumes[-10080] / 10080
-        self.tics.append(tic)
-        self.prices.append(price)
-        self.volumes.append(volume)
-        self.tics.pop(0)
-        self.prices.pop(0)
-        self.volumes.pop(0)
+        rows = np.zeros(1, dtype=np.int64)
+        self.price_ma.update(rows, price, {unit: self.prices[-unit] for unit in self.price_ma.units})
+        self.volume_ma.update(rows, volume, {unit: self.volumes[-unit] for unit in self.volume_ma.units})
+        self.tics.push(tic)
+        self.prices.push(price)
+        self.volumes.push(volume)
+        if len(self.price_ma.need_resync(rows)):    # 定期用原始窗口精确重算
+            self.price_ma.reset(rows, [self.prices.to_array()])
+            self.volume_ma.reset(rows, [self.volumes.to_array()])
+        self._update_ma()
 
     def execute(self):
         """执行监控，同类提示每10分钟最多一次"""
@@ -111,79 +130,492 @@ class Monitor:
             return
 
 
-if __name__ == "__main__":
+class Checkpoint:
+    """定期保存引擎状态快照，重启时用于快速恢复"""
 
-    print("更新所有币种最新数据...")
-    data_loader.update_data_all()
+    def __init__(self, engine, file, interval=300, **meta):
+        self.engine = engine
+        self.file = file
+        self.interval = interval
+        self.meta = meta
+        self.last_save_tic = time.time()
 
-    print("为所有币种创建监控...")
-    monitors = {}
-    last_timestamps = {}
+    def save(self):
+        try:
+            data_loader.writer.flush()    # 快照之前的数据须已落盘，恢复时才能追赶到最新
+            self.engine.save(self.file, **self.meta)
+        except Exception as e:
+            print("FAIL: save snapshot %s: %s" % (self.file, e))
+        self.last_save_tic = time.time()
+
+    def update(self):
+        """每interval秒保存一次快照"""
+        if time.time() - self.last_save_tic > self.interval:
+            self.save()
+
+
+def read_histories():
+    """读取所有币种的历史数据
+
+    returns: {symbol: `data_loader.Data`}，只包含数据满足监控条件的币种
+    """
+
+    print("读取所有币种历史数据...")
+    histories = {}
     for coin in data_loader.COINS:
-        file = "data/%s.1m.data" % coin
+        file = data_loader.get_data_file(coin)
         if not os.path.exists(file):
             continue
         data = data_loader.Data(file)    # 读取历史数据
         if len(data.prices) < data_loader.DAY * 7:    # 数据不满足监控条件（需要计算滑动平均价/交易额）
             continue
-        monitors[coin] = Monitor(    # 创建模型
-            coin,
-            data.tics[-data_loader.DAY*7:],
-            data.prices[-data_loader.DAY*7:],
-            data.volumes[-data_loader.DAY*7:],
-            volume_ratio=10,
-        )
-        last_timestamps[coin] = data.tics[-1]
+        histories[coin] = data
+    return histories
+
+
+def restore_engine(snapshot, top=0, index_size=100, rules_file=None, dispatcher=None, provisional=False):
+    """从快照恢复监控引擎，只追赶快照之后的新数据
 
+    provisional: 是否接受快照中尚未写入数据文件的临时K线 (快照模式，由`reconcile`核对替换)
+    returns: (engine, last_timestamps)，快照不存在、与参数不符或币种与数据文件不一致时返回None
+    """
+
+    if not snapshot or not os.path.exists(snapshot):
+        return None
+    rules = RuleSet.load(rules_file) if rules_file else None
+    try:
+        engine, meta = MonitorEngine.restore(snapshot, rules=rules, dispatcher=dispatcher)
+    except Exception as e:
+        print("FAIL: restore snapshot %s: %s" % (snapshot, e))
+        return None
+    if meta.get("top") != top or meta.get("index_size") != index_size:
+        print("快照的币种筛选参数不一致，重新创建监控...")
+        return None
+
+    histories = read_histories()
+    if set(histories) != set(engine.symbols):    # 快照之后有新增或不再满足条件的币种
+        print("快照的币种与数据文件不一致 (快照%d个，数据文件%d个)，重新创建监控..." % (len(engine.symbols), len(histories)))
+        return None
+
+    ahead = [
+        coin for coin, tic in zip(engine.symbols, engine.last(engine.tics))
+        if tic > histories[coin].tics[-1]
+    ]
+    if ahead and not provisional:    # 其他接入方式无法替换临时K线
+        print("快照中有%d个币种的临时K线未写入数据文件，重新创建监控..." % len(ahead))
+        return None
+
+    print("从快照`%s`恢复%d个币种的监控..." % (snapshot, len(engine.symbols)))
+    n = engine.replay({coin: (data.tics, data.prices, data.volumes) for coin, data in histories.items()})
+    print("追赶快照之后的%d条K线" % n)
+
+    # 以数据文件为准：快照模式下引擎中可能有尚未写入文件的临时K线，需从文件末尾重新请求`/klines`核对
+    last_timestamps = {coin: int(data.tics[-1]) for coin, data in histories.items()}
+    return engine, last_timestamps
+
+
+def create_engine(top=0, index_size=100, rules_file=None, dispatcher=None):
+    """读取历史数据，按7日均交易额排序后创建监控引擎
+
+    引擎包含所有数据满足条件的币种，以便运行中重新排名；只监控前top的币种由`universe.Universe`负责
+    returns: (engine, last_timestamps)
+    """
+
+    histories = read_histories()
     print("计算头部交易额币种...")
-    items = [(coin, monitors[coin].ma_7d_volume) for coin in monitors]
+    items = [(coin, data.volumes[-data_loader.DAY*7:].mean()) for coin, data in histories.items()]
     items.sort(key=lambda x: x[1], reverse=True)
-    top100 = {}
-    for i, item in enumerate(items[:100]):
-        coin = item[0]
-        mean_volume = item[1]
+    for i, (coin, mean_volume) in enumerate(items[:index_size]):
         print("No.%d %s $%d" % (i + 1, coin, mean_volume))
-        top100[coin] = monitors[coin]
 
-    print("准备当期指数计算...")
-    init_prices = {}
-    for coin, monitor in top100.items():
-        init_prices[coin] = monitor.prices[-1]
-    last_cal_index_tic = -1
+    print("为%d个币种创建监控 (执行监控规则: %s)..." % (len(items), "前%d个" % top if top else "全部"))
+    rules = RuleSet.load(rules_file) if rules_file else None
+    engine = MonitorEngine([coin for coin, _ in items], rules=rules, dispatcher=dispatcher)
+    last_timestamps = {}
+    for coin in engine.symbols:
+        data = histories[coin]
+        engine.load(coin, data.tics, data.prices, data.volumes)
+        last_timestamps[coin] = int(data.tics[-1])
+    return engine, last_timestamps
+
+
+def register_metrics(engine, last_timestamps, dispatcher):
+    """注册监控进程的回调式指标：各币种数据延迟 (当前时间 - 最新K线收线时间) 及告警队列状态"""
+
+    def lags():
+        now = time.time()
+        return {
+            (("symbol", coin),): round(now - (last_timestamps[coin] + 60 * data_loader.TIMESTAMP_UNIT) / data_loader.TIMESTAMP_UNIT, 3)
+            for coin in engine.symbols
+        }
+
+    def alert_stats():
+        return {
+            (("sink", sink), ("state", state)): value
+            for sink, stats in dispatcher.stats().items() for state, value in stats.items()
+        }
+
+    metrics.registry.gauge("monitor_symbol_lag_seconds", lags, "当前时间与最新已收线K线的间隔")
+    metrics.registry.gauge("monitor_max_lag_seconds", lambda: max(lags().values(), default=0), "各币种数据延迟的最大值")
+    metrics.registry.gauge("alert_dispatch", alert_stats, "各告警通道的发送/丢弃/失败/排队数")
+
+
+def handle_bars(engine, bars, last_timestamps, universe=None):
+    """写入新K线，并按分钟对齐批量执行监控
+
+    bars: {symbol: [kline, ...]}
+    """
+
+    with metrics.registry.timer("monitor_stage_seconds", stage="append"):
+        for coin, latest_data in bars.items():
+            data_loader.writer.append(data_loader.get_data_file(coin), latest_data)
+            last_timestamps[coin] = int(latest_data[-1][0])
+        data_loader.writer.flush()    # 每批次落盘，异常退出时不丢失已收到的K线
+    engine.feed(bars)
+    if universe is not None:
+        universe.on_bars(bars)
+
+
+def run_polling(engine, universe, last_timestamps, fetcher="async", api_url=None, periodic=(), offset=1.0):
+    """轮询模式：每个交易所分钟边界+offset秒唤醒，请求下一根K线已收线的币种的`/klines`
+
+    periodic: 每次唤醒调用其update()的对象 (定期保存快照、打印运行指标等)
+    """
+
+    client = None
+    if fetcher == "async":
+        import asyncio
+        from async_binance import AsyncBinanceAPI
+        loop = asyncio.new_event_loop()
+        client = AsyncBinanceAPI(base_url=api_url)
+        loop.run_until_complete(client.open())
+
+    clock = ServerClock(data_loader.instance.get_time)
+    scheduler = MinuteScheduler(clock, offset)
+    metrics.registry.gauge("monitor_clock_offset_seconds", lambda: round(clock.offset, 3), "服务器时钟与本地时钟的偏差")
 
-    print("开始执行价量监控...")
-    pygame.mixer.init()
-    pygame.mixer.music.load("refs/alarm.mp3")
     while True:
+        clock.update()
+        universe.report()
+        for item in periodic:
+            item.update()
 
-        # 计算top100综合价格指数
-        index = 0
-        for coin, monitor in top100.items():
-            index += monitor.prices[-1] / init_prices[coin] / 100
-        if time.time() - last_cal_index_tic > 600:
-            print("%s --- 价格指数, %.3f" % (
-                utils.tic2time(time.time()),
-                index,
-            ))
-            last_cal_index_tic = time.time()
-
-        # 跟踪价量
-        for coin, monitor in top100.items():
-
-            # 获取最新数据
-            latest_data = data_loader.get_latest_data(coin, "1m", last_timestamps[coin] + 1, verbosity=0)
-            if not isinstance(latest_data, list) or len(latest_data) == 0:    # 未能获得最新数据
-                continue
+        symbols = scheduler.due(engine.symbols, last_timestamps)
+        if symbols:
+            with metrics.registry.timer("monitor_sweep_seconds"):
+
+                # 获取最新数据
+                with metrics.registry.timer("monitor_stage_seconds", stage="fetch"):
+                    if client is not None:    # 并发请求
+                        latest = loop.run_until_complete(client.get_latest_data_many(
+                            {coin: last_timestamps[coin] + 1 for coin in symbols},
+                        ))
+                    else:
+                        latest = {
+                            coin: data_loader.get_latest_data(coin, "1m", last_timestamps[coin] + 1, verbosity=0)
+                            for coin in symbols
+                        }
+
+                # 跟踪价量 (只使用已收线的K线)
+                now = clock.now()
+                now_timestamp = int(now * data_loader.TIMESTAMP_UNIT)
+                bars = {}
+                for coin in symbols:
+                    latest_data = latest.get(coin)
+                    if not isinstance(latest_data, list):    # 未能获得最新数据
+                        metrics.registry.inc("monitor_fetch_failures_total")
+                        latest_data = []
+                    latest_data = [item for item in latest_data if int(item[6]) < now_timestamp]
+                    if len(latest_data) == 0:    # 交易所尚未生成，稍后重试
+                        scheduler.retry(coin, now)
+                        continue
+                    scheduler.done(coin)
+                    bars[coin] = latest_data
+                handle_bars(engine, bars, last_timestamps, universe)
+
+            # K线收线到执行完监控的延迟
+            now = clock.now()
+            for coin in bars:
+                close = (last_timestamps[coin] + 60 * data_loader.TIMESTAMP_UNIT) / data_loader.TIMESTAMP_UNIT
+                metrics.registry.observe("monitor_bar_delay_seconds", now - close)
+
+        scheduler.sleep()
 
-            # 更新文件
-            file = "data/%s.1m.data" % coin
-            with open(file, "a", encoding="utf-8") as f:
-                for item in latest_data:
-                    monitor.update(
-                        tic=float(item[0]),
-                        price=float(item[4]),
-                        volume=float(item[7]),
-                    )
-                    monitor.execute()
-                    f.write("%s\n" % "\t".join(list(map(str, item))))
+
+def reconcile(engine, latest, last_timestamps):
+    """用已收线的K线核对临时K线：写入数据文件，替换引擎中同一时间的临时K线，并追加引擎中缺少的K线
+
+    latest: {symbol: [kline, ...]}
+    returns: 引擎最新一分钟被替换的行
+    """
+
+    revised = []
+    appended = {}
+    with metrics.registry.timer("monitor_stage_seconds", stage="append"):
+        for coin, latest_data in latest.items():
+            data_loader.writer.append(data_loader.get_data_file(coin), latest_data)
             last_timestamps[coin] = int(latest_data[-1][0])
+
+            row = engine.rows[coin]
+            last_tic = engine.last(engine.tics, [row])[0]
+            items = [item for item in latest_data if int(item[0]) <= last_tic]
+            if items:
+                engine.revise(
+                    row,
+                    [int(item[0]) for item in items],
+                    [float(item[4]) for item in items],
+                    [float(item[7]) for item in items],
+                )
+                if int(items[-1][0]) == last_tic:
+                    revised.append(row)
+            items = [item for item in latest_data if int(item[0]) > last_tic]
+            if items:
+                appended[coin] = items
+        data_loader.writer.flush()    # 每批次落盘
+    engine.feed(appended)
+    return revised
+
+
+def run_tickers(engine, universe, last_timestamps, api_url=None, periodic=(), offset=1.0, reconcile_interval=60):
+    """快照模式：每分钟一次全市场`/ticker/24hr`请求构造所有币种的临时K线 (见`tickers.TickerBars`)，
+    只对满足规则条件的币种立即请求`/klines`核对后执行监控，其余币种轮流核对
+
+    reconcile_interval: 每个币种至少每隔多少分钟核对一次
+    """
+
+    import asyncio
+    from async_binance import AsyncBinanceAPI
+
+    loop = asyncio.new_event_loop()
+    client = AsyncBinanceAPI(base_url=api_url)
+    loop.run_until_complete(client.open())
+
+    clock = ServerClock(data_loader.instance.get_time)
+    scheduler = MinuteScheduler(clock, offset)
+    metrics.registry.gauge("monitor_clock_offset_seconds", lambda: round(clock.offset, 3), "服务器时钟与本地时钟的偏差")
+    builder = TickerBars(engine)
+    batch = -(-len(engine.symbols) // reconcile_interval)    # 每分钟轮流核对的币种数
+    pending = set()    # 等待核对后执行监控的币种
+    wanted = set()    # 需要尽快取到刚收线的K线的币种 (等待执行监控或引擎数据不连续)
+    minute = None
+
+    while True:
+        clock.update()
+        universe.report()
+        for item in periodic:
+            item.update()
+
+        now = clock.now()
+        tic = int(now // 60 - 1) * 60 * data_loader.TIMESTAMP_UNIT    # 刚收线的分钟
+        symbols = []
+        if tic != minute:
+            minute = tic
+
+            # 全市场快照 -> 临时K线
+            with metrics.registry.timer("monitor_stage_seconds", stage="tickers"):
+                tickers = loop.run_until_complete(client.get_tickers())
+            if isinstance(tickers, list):
+                rows, prices, volumes = builder.build(tickers, tic)
+                with metrics.registry.timer("monitor_stage_seconds", stage="update"):
+                    engine.update(rows, tic, prices, volumes)
+                universe.on_prices(rows, prices)
+                pending |= {engine.symbols[row] for row in engine.candidates(rows)}
+            else:
+                metrics.registry.inc("monitor_fetch_failures_total")
+            lagging = {coin for coin, last_tic in zip(engine.symbols, engine.last(engine.tics)) if last_tic < tic}
+            wanted = pending | lagging
+            symbols = sorted(wanted) + sorted(engine.symbols, key=last_timestamps.get)[:batch]
+
+        symbols += [coin for coin in scheduler.due(list(scheduler.retries), last_timestamps, now) if coin not in symbols]
+        if symbols:
+            with metrics.registry.timer("monitor_sweep_seconds"):
+                with metrics.registry.timer("monitor_stage_seconds", stage="fetch"):
+                    latest = loop.run_until_complete(client.get_latest_data_many(
+                        {coin: last_timestamps[coin] + 1 for coin in dict.fromkeys(symbols)},
+                    ))
+
+                now = clock.now()
+                now_timestamp = int(now * data_loader.TIMESTAMP_UNIT)
+                bars = {}
+                for coin, latest_data in latest.items():
+                    if not isinstance(latest_data, list):
+                        metrics.registry.inc("monitor_fetch_failures_total")
+                        latest_data = []
+                    latest_data = [item for item in latest_data if int(item[6]) < now_timestamp]
+                    if latest_data:
+                        bars[coin] = latest_data
+                    if coin not in wanted:
+                        continue
+                    if latest_data and int(latest_data[-1][0]) >= minute:
+                        scheduler.done(coin)
+                        wanted.discard(coin)
+                    else:    # 交易所尚未生成，稍后重试
+                        scheduler.retry(coin, now)
+
+                # 核对后对满足规则条件的币种执行监控
+                revised = reconcile(engine, bars, last_timestamps)
+                with metrics.registry.timer("monitor_stage_seconds", stage="execute"):
+                    engine.execute([row for row in revised if engine.symbols[row] in pending])
+                pending -= set(bars) - wanted
+
+        scheduler.sleep()
+
+
+def run_sharded(workers, dispatcher, rules_file=None, api_url=None, top=0, index_size=100, rank_interval=3600, offset=1.0, periodic=()):
+    """多进程模式：币种按哈希分配到workers个工作进程分别轮询并执行监控，见`shard.Coordinator`"""
+
+    import shard
+
+    symbols = [coin for coin in data_loader.COINS if os.path.exists(data_loader.get_data_file(coin))]
+    coordinator = shard.Coordinator(
+        symbols,
+        workers,
+        dispatcher,
+        rules_file,
+        api_url,
+        top,
+        index_size,
+        rank_interval,
+        offset,
+    )
+    try:
+        coordinator.run(periodic)
+    finally:
+        coordinator.stop()
+        dispatcher.close()
+
+
+def run_streaming(engine, universe, last_timestamps, stream_url=None, api_url=None, record=None, periodic=()):
+    """推送模式：订阅K线推送，收线后立即执行监控，断线后自动重连并通过REST补齐缺口"""
+
+    import asyncio
+    import stream
+    from async_binance import AsyncBinanceAPI
+
+    def on_bars(bars):
+        handle_bars(engine, bars, last_timestamps, universe)
+        universe.report()
+        for item in periodic:
+            item.update()
+
+    async def run():
+        async with AsyncBinanceAPI(base_url=api_url) as client:
+
+            # 先补齐启动以来缺失的已收线K线，再开始接收推送
+            latest = await client.get_latest_data_many({coin: last_timestamps[coin] + 1 for coin in engine.symbols})
+            now_timestamp = int(time.time() * data_loader.TIMESTAMP_UNIT)
+            latest = {coin: [item for item in data if int(item[6]) < now_timestamp] for coin, data in latest.items() if data}
+            on_bars({coin: data for coin, data in latest.items() if data})
+
+            kline_stream = stream.KlineStream(
+                engine.symbols,
+                on_bars,
+                last_timestamps,
+                client=client,
+                url=stream_url or stream.STREAM_URL,
+                record=record,
+            )
+            await kline_stream.run()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="币安价量监控")
+    parser.add_argument("--top", type=int, default=0, help="只监控7日均交易额前N的币种 (默认0，监控全部币种)，运行中定期重新排名")
+    parser.add_argument("--index-size", type=int, default=100, help="价格指数包含的头部币种数量")
+    parser.add_argument("--rank-interval", type=int, default=3600, help="按7日均交易额重新排名的间隔 (秒)")
+    parser.add_argument("--rules", default=None, help="告警规则配置文件 (默认为`rules.json`)")
+    parser.add_argument("--alert-log", default=None, help="告警日志文件 (每行一条JSON)")
+    parser.add_argument("--webhook", default=None, help="告警webhook地址 (POST JSON)")
+    parser.add_argument("--snapshot", default=None, help="引擎状态快照文件，重启时从快照快速恢复 (默认为`data/engine.npz`，设为空字符串则不使用)")
+    parser.add_argument("--snapshot-interval", type=int, default=300, help="保存快照的间隔 (秒)")
+    parser.add_argument("--shared-memory", default=None, help="发布实时价量矩阵的共享内存名称 (见`shared_candles.py`，默认为`%s`，设为空字符串则不发布)" % shared_candles.NAME)
+    parser.add_argument("--metrics-port", type=int, default=metrics.PORT, help="运行指标接口端口 (http://127.0.0.1:PORT/metrics，0为不启用)")
+    parser.add_argument("--metrics-log", type=int, default=0, help="定期打印运行指标摘要的间隔 (秒，0为不打印)")
+    parser.add_argument("--ingest", choices=["poll", "tickers", "stream"], default=None, help="行情接入方式 (默认poll: 轮询`/klines`, tickers: 全市场行情快照, stream: WebSocket推送)")
+    parser.add_argument("--poll-offset", type=float, default=1.0, help="轮询模式下在每个分钟边界之后等待的秒数")
+    parser.add_argument("--reconcile-interval", type=int, default=60, help="快照模式下每个币种用`/klines`核对的间隔 (分钟)")
+    parser.add_argument("--workers", type=int, default=0, help="多进程轮询的工作进程数 (币种按哈希分片，0为单进程)，不能与--ingest/--fetcher/--snapshot/--shared-memory同时使用")
+    parser.add_argument("--fetcher", choices=["async", "sync"], default=None, help="轮询模式下的行情获取方式 (默认async: 多币种并发请求)")
+    parser.add_argument("--api-url", default=None, help="REST接口地址 (默认为`api.conf`中的\"API URL\"或币安官方地址，可指向`mock_binance.py`)")
+    parser.add_argument("--stream-url", default=None, help="WebSocket推送地址 (默认为币安官方地址)")
+    parser.add_argument("--record", default=None, help="推送模式下录制推送消息的文件，可用于`stream.ReplayServer`回放")
+    args = parser.parse_args()
+    if args.workers:    # 多进程模式只支持异步轮询，不保存快照、不发布共享内存
+        conflicts = [
+            name for name, value in (
+                ("--ingest", args.ingest),
+                ("--fetcher", args.fetcher),
+                ("--snapshot", args.snapshot),
+                ("--shared-memory", args.shared_memory),
+            ) if value is not None
+        ]
+        if conflicts:
+            parser.error("%s不能与--workers同时使用" % ", ".join(conflicts))
+    args.ingest = args.ingest or "poll"
+    args.fetcher = args.fetcher or "async"
+    args.snapshot = "data/engine.npz" if args.snapshot is None else args.snapshot
+    args.shared_memory = shared_candles.NAME if args.shared_memory is None else args.shared_memory
+
+    api_url = args.api_url or data_loader.instance.base_url    # 同步/异步客户端使用同一接口地址
+    data_loader.instance.base_url = api_url
+    print("更新所有币种最新数据...")
+    data_loader.update_data_all(base_url=api_url)
+
+    pygame.mixer.init()
+    pygame.mixer.music.load("refs/alarm.mp3")
+    sinks = [alerts.ConsoleSink(), alerts.SoundSink()]
+    if args.alert_log:
+        sinks.append(alerts.JsonlSink(args.alert_log))
+    if args.webhook:
+        sinks.append(alerts.WebhookSink(args.webhook))
+    dispatcher = alerts.AlertDispatcher(sinks)
+
+    if args.workers:    # 多进程分片监控，各工作进程自行读取历史数据
+        periodic = []
+        if args.metrics_port:
+            metrics.start_server(port=args.metrics_port)
+        if args.metrics_log:
+            periodic.append(metrics.PeriodicLog(interval=args.metrics_log))
+        print("开始执行价量监控 (%d个工作进程)..." % args.workers)
+        run_sharded(args.workers, dispatcher, args.rules, api_url, args.top, args.index_size, args.rank_interval, args.poll_offset, periodic)
+    else:
+        restored = restore_engine(args.snapshot, args.top, args.index_size, args.rules, dispatcher, args.ingest == "tickers")
+        if restored is None:
+            restored = create_engine(args.top, args.index_size, args.rules, dispatcher)
+        engine, last_timestamps = restored
+        shared = None
+        if args.shared_memory:
+            shared = shared_candles.SharedCandles.create(engine.symbols, engine.capacity, args.shared_memory)
+            engine.share(shared)
+        universe = Universe(engine, args.top, args.index_size, args.rank_interval)
+
+        periodic = [universe]
+        checkpoint = None
+        if args.snapshot:
+            checkpoint = Checkpoint(engine, args.snapshot, args.snapshot_interval, top=args.top, index_size=args.index_size)
+            checkpoint.save()
+            periodic.append(checkpoint)
+        register_metrics(engine, last_timestamps, dispatcher)
+        if args.metrics_port:
+            metrics.start_server(port=args.metrics_port)
+        if args.metrics_log:
+            periodic.append(metrics.PeriodicLog(interval=args.metrics_log))
+
+        print("开始执行价量监控...")
+        try:
+            if args.ingest == "stream":
+                run_streaming(engine, universe, last_timestamps, args.stream_url, api_url, args.record, periodic)
+            elif args.ingest == "tickers":
+                run_tickers(engine, universe, last_timestamps, api_url, periodic, args.poll_offset, args.reconcile_interval)
+            else:
+                run_polling(engine, universe, last_timestamps, args.fetcher, api_url, periodic, args.poll_offset)
+        finally:
+            data_loader.writer.close()
+            if checkpoint is not None:
+                checkpoint.save()    # 退出前保存最新状态
+            if shared is not None:
+                shared.close()
+            dispatcher.close()
@@ -0,0 +1,39 @@
+# K线分页规划：每页请求最大条数，根据实际返回的最后一条K线推进下一页的起点
+
+KLINES_LIMIT = 1000    # `/klines`单次最多返回的条数
+MINUTE_MS = 60 * 1000
+
+
+class PagePlanner:
+    """单个币种的分页规划
+
+    请求只给出起始时间和条数 (不带结束时间)，币安会从起始时间之后第一条存在的K线开始返回。
+    因此第一页同时起到探测作用：新上线币种上线前的空白区间只需一次请求即可跳过，无数据的币种一次请求即结束；
+    之后每页的起点为上一页最后一条K线的开盘时间+60秒，返回不足一页说明已取到最新
+    """
+
+    def __init__(self, start_timestamp, limit=KLINES_LIMIT, interval_ms=MINUTE_MS):
+        self.start = start_timestamp    # 下一页的起始时间
+        self.limit = limit
+        self.interval_ms = interval_ms
+        self.first_timestamp = None    # 探测到的第一条K线的开盘时间
+        self.pages = 0    # 已请求页数
+        self.done = False
+
+    def next_page(self):
+        """下一页的请求参数 (startTime, limit)，已取完返回None"""
+        if self.done:
+            return None
+        return self.start, self.limit
+
+    def feed(self, rows):
+        """根据返回的数据推进分页，返回rows本身"""
+
+        self.pages += 1
+        if rows:
+            if self.first_timestamp is None:
+                self.first_timestamp = int(rows[0][0])
+            self.start = int(rows[-1][0]) + self.interval_ms
+        if len(rows) < self.limit:
+            self.done = True
+        return rows
@@ -0,0 +1,68 @@
+# 定长环形窗口，用于保存最近N分钟的时间戳/价格/交易额
+
+import numpy as np
+
+
+class RingBuffer:
+    """基于数组的定长环形窗口
+
+    push为O(1)，写满后覆盖最旧的元素；支持负索引，window[-1]为最新元素，window[-n]为最旧元素
+    """
+
+    __slots__ = ("_data", "_capacity", "_head", "_size")
+
+    def __init__(self, capacity, dtype=np.float64, values=None):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._capacity = capacity
+        self._head = 0    # 下一个写入位置
+        self._size = 0
+        if values is not None:
+            self.extend(values)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def push(self, value):
+        """追加一个元素"""
+        self._data[self._head] = value
+        self._head += 1
+        if self._head == self._capacity:
+            self._head = 0
+        if self._size < self._capacity:
+            self._size += 1
+
+    def extend(self, values):
+        """批量追加，超出容量时只保留最后capacity个"""
+
+        values = np.asarray(values, dtype=self._data.dtype)[-self._capacity:]
+        n = len(values)
+        if n == 0:
+            return
+        first = min(n, self._capacity - self._head)
+        self._data[self._head:self._head + first] = values[:first]
+        self._data[:n - first] = values[first:]
+        self._head = (self._head + n) % self._capacity
+        self._size = min(self._size + n, self._capacity)
+
+    def to_array(self):
+        """按时间顺序返回窗口内容的拷贝"""
+        start = (self._head - self._size) % self._capacity
+        if start + self._size <= self._capacity:
+            return self._data[start:start + self._size].copy()
+        return np.concatenate((self._data[start:], self._data[:self._head]))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.to_array()[i]
+        if i < 0:
+            i += self._size
+        if i < 0 or i >= self._size:
+            raise IndexError("ring buffer index out of range")
+        return self._data[(self._head - self._size + i) % self._capacity]
+
+    def __repr__(self):
+        return "RingBuffer(capacity=%d, size=%d)" % (self._capacity, self._size)
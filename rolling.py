@@ -0,0 +1,107 @@
+# 滑动统计：多窗口滑动平均的批量计算 (一次cumsum) 与无漂移的增量更新
+
+import numpy as np
+
+
+UNITS = {"m": 1, "h": 60, "d": 60 * 24}    # 以分钟为基础数据单位
+
+
+def parse_window(interval):
+    """将"7m"/"7h"/"7d"等转换为分钟数，整数原样返回"""
+    if isinstance(interval, (int, np.integer)):
+        return int(interval)
+    return int(interval[:-1]) * UNITS[interval[-1]]
+
+
+def moving_averages(values, intervals):
+    """一次cumsum计算多个窗口的完整滑动平均序列
+
+    values: 一维序列，或二维数组 (每行一个序列，沿最后一维滑动)
+    intervals: e.g. ["7m", "7h", "7d"]
+    returns: {interval: 与values同形状的数组，头部不满足长度要求的为NaN}
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    cumsum = np.zeros(values.shape[:-1] + (n + 1,))
+    np.cumsum(values, axis=-1, out=cumsum[..., 1:])
+
+    results = {}
+    for interval in intervals:
+        unit = parse_window(interval)
+        ma = np.full(values.shape, np.nan)
+        if unit <= n:
+            ma[..., unit - 1:] = (cumsum[..., unit:] - cumsum[..., :-unit]) / unit
+        results[interval] = ma
+    return results
+
+
+class RollingMean:
+    """多序列、多窗口的增量滑动平均
+
+    每个窗口维护一个滑动和，新值加入、旧值移出均使用Neumaier补偿求和，长时间运行也不会累积浮点误差；
+    另外每个序列更新resync次后标记为需要重算 (见`need_resync`)，由调用方用原始窗口数据精确重置
+
+    n: 序列数量 (如币种数)
+    intervals: e.g. ["7m", "7h", "7d"]
+    """
+
+    def __init__(self, n, intervals, resync=60 * 24):
+        self.intervals = list(intervals)
+        self.units = [parse_window(interval) for interval in self.intervals]
+        self.resync = resync
+        self.sums = np.zeros((len(self.units), n))
+        self.compensations = np.zeros((len(self.units), n))
+        self.updates = np.zeros(n, dtype=np.int64)    # 距上次精确重置的更新次数
+
+    def reset(self, rows, history):
+        """用原始数据精确重置rows的滑动和
+
+        history: 二维数组，每行对应rows中的一个序列，按时间顺序，长度不小于最大窗口
+        """
+
+        history = np.asarray(history, dtype=np.float64)
+        for k, unit in enumerate(self.units):
+            self.sums[k, rows] = history[:, -unit:].sum(axis=1)
+            self.compensations[k, rows] = 0
+        self.updates[rows] = 0
+
+    def _add(self, k, rows, x):
+        """Neumaier补偿求和: sums[k, rows] += x"""
+
+        s = self.sums[k, rows]
+        t = s + x
+        self.compensations[k, rows] += np.where(np.abs(s) >= np.abs(x), (s - t) + x, (x - t) + s)
+        self.sums[k, rows] = t
+
+    def update(self, rows, values, olds):
+        """加入新值并移出各窗口最旧的值
+
+        values: rows对应的新值
+        olds: {unit: rows对应的移出窗口的值}
+        """
+
+        for k, unit in enumerate(self.units):
+            self._add(k, rows, values)
+            self._add(k, rows, -olds[unit])
+        self.updates[rows] += 1
+
+    def adjust(self, row, deltas, ages):
+        """修正第row个序列窗口内已有的值
+
+        deltas: 各值的修正量
+        ages: 各值的位置 (1为最新值)，只修正包含该位置的窗口
+        """
+
+        deltas = np.asarray(deltas, dtype=np.float64)
+        for k, unit in enumerate(self.units):
+            self._add(k, [row], np.array([deltas[ages <= unit].sum()]))
+
+    def need_resync(self, rows):
+        """rows中需要精确重置的序列"""
+        return rows[self.updates[rows] >= self.resync]
+
+    def mean(self, interval):
+        """所有序列在指定窗口的滑动平均"""
+        k = self.intervals.index(interval)
+        return (self.sums[k] + self.compensations[k]) / self.units[k]
@@ -0,0 +1,272 @@
+# 声明式告警规则：从`rules.json`读取规则，编译为基于滑动窗口的批量判断
+#
+# 规则条件为表达式字符串，可用的变量和函数：
+#   price, volume              最新一分钟的价格/交易额
+#   ma(x, 7h)                  滑动平均 (窗口单位m/h/d)
+#   max(x, 9m), min(x, 9m)     此前9分钟内的最大/最小值 (不含最新一分钟)
+#   lag(x, 9m)                 此前第1~9分钟的值，结果为每个币种9列
+#   change(x, 9m)              相对此前第1~9分钟的涨跌幅，即 x / lag(x, 9m) - 1
+#   floor(x), abs(x)
+# 含有lag/change的条件对每一列分别判断，任意一列满足即触发，{minutes}为满足条件的最短分钟数。
+# 规则的params中定义的具名参数 (如阈值) 可在表达式中直接使用，便于回测时批量调整 (见`backtest.py`)。
+# 同一批次中，所有规则用到的相同中间量 (如ma(volume, 7h)) 只计算一次
+
+import os
+import re
+import ast
+import json
+import numpy as np
+
+from rolling import parse_window
+
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+SERIES = ("price", "volume")
+WINDOW_PATTERN = re.compile(r"\b(\d+)([mhd])\b")
+
+
+class Context:
+    """一次批量判断的上下文，缓存各规则共享的中间量"""
+
+    def __init__(self, engine, rows):
+        self.engine = engine
+        self.rows = rows
+        self.cache = {}
+
+    def get(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def matrix(self, series):
+        return self.engine.prices if series == "price" else self.engine.volumes
+
+    def latest(self, series):
+        return self.get(("latest", series), lambda: self.engine.last(self.matrix(series), self.rows))
+
+    def window(self, series, unit):
+        """最近unit+1分钟的数据，最后一列为最新值"""
+        return self.get(("window", series, unit), lambda: self.engine.window(self.matrix(series), self.rows, unit + 1))
+
+    def ma(self, series, unit):
+        return self.get(("ma", series, unit), lambda: self.engine.moving_average(series, unit)[self.rows])
+
+    def max(self, series, unit):
+        return self.get(("max", series, unit), lambda: self.window(series, unit)[:, :-1].max(axis=1))
+
+    def min(self, series, unit):
+        return self.get(("min", series, unit), lambda: self.window(series, unit)[:, :-1].min(axis=1))
+
+    def lag(self, series, unit):
+        """第i列 (从0开始) 为此前第i+1分钟的值"""
+        return self.get(("lag", series, unit), lambda: self.window(series, unit)[:, -2::-1])
+
+    def change(self, series, unit):
+        return self.get(("change", series, unit), lambda: self.latest(series)[:, None] / self.lag(series, unit) - 1)
+
+
+def _broadcast(a, b):
+    """一维 (每个币种一个值) 与二维 (每个币种多列) 运算时，将一维扩展为列向量"""
+    if np.ndim(a) == 1 and np.ndim(b) == 2:
+        a = a[:, None]
+    elif np.ndim(a) == 2 and np.ndim(b) == 1:
+        b = b[:, None]
+    return a, b
+
+
+class Expression:
+    """将表达式字符串编译为 fn(context) -> 数组"""
+
+    BINARY = {
+        ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+    }
+    COMPARE = {
+        ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+        ast.Eq: np.equal, ast.NotEq: np.not_equal,
+    }
+    WINDOW_FUNCTIONS = ("ma", "max", "min", "lag", "change")
+    FUNCTIONS = {"floor": np.floor, "abs": np.abs}
+
+    def __init__(self, source, params=None):
+        self.source = source
+        self.params = params or {}    # 具名参数 (如阈值)，编译为常量
+        self.moving_averages = set()    # 用到的滑动平均 (series, unit)
+        self.lookback = 0    # 需要回看的分钟数
+        try:
+            tree = ast.parse(WINDOW_PATTERN.sub(r"'\1\2'", source), mode="eval")
+        except SyntaxError as e:
+            raise ValueError("invalid rule expression `%s`: %s" % (source, e))
+        self.fn = self._compile(tree.body)
+
+    def __call__(self, context):
+        return self.fn(context)
+
+    def _error(self, message):
+        return ValueError("invalid rule expression `%s`: %s" % (self.source, message))
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = node.value
+            return lambda context: value
+
+        if isinstance(node, ast.Name) and node.id in self.params:
+            value = self.params[node.id]
+            return lambda context: value
+
+        if isinstance(node, ast.Name):
+            if node.id not in SERIES:
+                raise self._error("unknown variable `%s`" % node.id)
+            series = node.id
+            return lambda context: context.latest(series)
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = self._compile(node.operand)
+            return lambda context: -operand(context)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in self.BINARY:
+            op = self.BINARY[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda context: op(*_broadcast(left(context), right(context)))
+
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in self.COMPARE:
+            op = self.COMPARE[type(node.ops[0])]
+            left, right = self._compile(node.left), self._compile(node.comparators[0])
+            return lambda context: op(*_broadcast(left(context), right(context)))
+
+        if isinstance(node, ast.BoolOp):
+            op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            values = [self._compile(value) for value in node.values]
+
+            def fn(context):
+                result = values[0](context)
+                for value in values[1:]:
+                    result = op(*_broadcast(result, value(context)))
+                return result
+            return fn
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            name = node.func.id
+            if name in self.FUNCTIONS and len(node.args) == 1:
+                f, arg = self.FUNCTIONS[name], self._compile(node.args[0])
+                return lambda context: f(arg(context))
+            if name in self.WINDOW_FUNCTIONS and len(node.args) == 2:
+                series, window = node.args
+                if not isinstance(series, ast.Name) or series.id not in SERIES:
+                    raise self._error("first argument of %s() must be price/volume" % name)
+                if not isinstance(window, ast.Constant) or not isinstance(window.value, str):
+                    raise self._error("second argument of %s() must be a window such as 7h" % name)
+                series, unit = series.id, parse_window(window.value)
+                if name == "ma":
+                    self.moving_averages.add((series, unit))
+                else:
+                    self.lookback = max(self.lookback, unit)
+                method = name
+                return lambda context: getattr(context, method)(series, unit)
+
+        raise self._error("unsupported syntax `%s`" % ast.dump(node))
+
+
+class Rule:
+    """一条告警规则
+
+    when: 条件列表，全部满足时触发
+    alarm: 提示类别 (同类提示共享提示状态，如上涨为1、下跌为-1)
+    repeat_after: 同类提示的最短间隔 (秒)
+    repeat_if: 超过间隔后再次提示的附加条件
+    exclusive: 触发 (即使被抑制) 后不再判断该币种后续的规则
+    """
+
+    def __init__(self, config, groups):
+        self.name = config["name"]
+        self.symbols = config.get("symbols", "*")
+        self.groups = groups
+        self.params = dict(config.get("params", {}))
+        self.when = [Expression(source, self.params) for source in config["when"]]
+        self.alarm = config.get("alarm", 1)
+        self.repeat_after = config.get("repeat_after", 600)
+        self.repeat_if = Expression(config["repeat_if"], self.params) if config.get("repeat_if") else None
+        self.values = {name: Expression(source, self.params) for name, source in config.get("values", {}).items()}
+        self.message = config["message"]
+        self.color = config.get("color")
+        self.sound = config.get("sound", 1)    # 提示音播放次数
+        self.exclusive = config.get("exclusive", True)
+        self.mask = None
+
+    def expressions(self):
+        return self.when + list(self.values.values()) + ([self.repeat_if] if self.repeat_if else [])
+
+    def bind(self, symbols):
+        """根据规则适用的币种/分组生成掩码"""
+
+        if self.symbols == "*":
+            self.mask = np.ones(len(symbols), dtype=bool)
+            return
+        targets = set()
+        for name in self.symbols:
+            targets.update(self.groups.get(name, [name]))
+        self.mask = np.array([symbol in targets for symbol in symbols], dtype=bool)
+
+    def evaluate(self, context):
+        """returns: (是否触发, 满足条件的最短回看列，无回看条件时为None)"""
+
+        hits = None
+        for expression in self.when:
+            result = expression(context)
+            hits = result if hits is None else np.logical_and(*_broadcast(hits, result))
+        if np.ndim(hits) == 2:
+            return hits.any(axis=1), np.argmax(hits, axis=1)
+        return np.asarray(hits, dtype=bool), None
+
+    def format(self, context, j, first, values=None):
+        """生成第j个币种的提示信息
+
+        values: 预先计算的 {name: expression(context)}，批量生成多条提示信息时避免重复计算
+        """
+
+        if values is None:
+            values = {name: expression(context) for name, expression in self.values.items()}
+        values = dict(values)
+        for name, value in values.items():
+            if np.ndim(value) == 2:
+                value = value[j, first[j] if first is not None else 0]
+            elif np.ndim(value) == 1:
+                value = value[j]
+            values[name] = float(value)
+        if first is not None:
+            values["minutes"] = int(first[j]) + 1
+        return self.message.format(**values)
+
+
+class RuleSet:
+    """一组按顺序判断的规则"""
+
+    def __init__(self, config):
+        self.groups = config.get("groups", {})
+        self.rules = [Rule(rule, self.groups) for rule in config["rules"]]
+
+    @classmethod
+    def load(cls, file=RULES_FILE):
+        with open(file, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def bind(self, symbols):
+        for rule in self.rules:
+            rule.bind(symbols)
+        return self
+
+    def moving_averages(self):
+        """所有规则用到的滑动平均窗口 {series: [unit, ...]}，由引擎增量维护"""
+
+        windows = {series: set() for series in SERIES}
+        for rule in self.rules:
+            for expression in rule.expressions():
+                for series, unit in expression.moving_averages:
+                    windows[series].add(unit)
+        return {series: sorted(units) for series, units in windows.items()}
+
+    @property
+    def lookback(self):
+        return max([expression.lookback for rule in self.rules for expression in rule.expressions()] + [0])
@@ -0,0 +1,120 @@
+# 轮询调度：在每个交易所分钟边界之后 (加一个小的偏移) 唤醒，只请求下一根K线已收线的币种，
+# 未取到新数据的币种按带随机抖动的指数退避重试，其余时间休眠
+#
+# 交易所分钟以服务器时间计，通过`/time`估计本地时钟与服务器时钟的偏差并定期校准
+
+import time
+import random
+
+import metrics
+
+
+MINUTE_MS = 60 * 1000
+
+
+class ServerClock:
+    """服务器时钟：服务器时间 = 本地时间 + offset
+
+    get_time: 返回 {"serverTime": 毫秒} 的函数，如`BinanceAPI.get_time`
+    interval: 校准间隔 (秒)
+    samples: 每次校准的请求次数，取往返时间最短的一次，以往返的中点估计偏差
+    """
+
+    def __init__(self, get_time, interval=600, samples=3):
+        self.get_time = get_time
+        self.interval = interval
+        self.samples = samples
+        self.offset = 0.0    # 秒
+        self.rtt = None    # 最近一次校准的往返时间 (秒)
+        self.last_sync_tic = -float("inf")
+
+    def sync(self):
+        best = None
+        for _ in range(self.samples):
+            start = time.time()
+            result = self.get_time()
+            end = time.time()
+            if not isinstance(result, dict) or "serverTime" not in result:
+                continue
+            if best is None or end - start < best[0]:
+                best = (end - start, result["serverTime"] / 1000 - (start + end) / 2)
+
+        if best is None:
+            print("FAIL: 校准服务器时间失败，1分钟后重试")
+            self.last_sync_tic = time.time() - self.interval + 60
+            return
+        self.rtt, self.offset = best
+        self.last_sync_tic = time.time()
+
+    def update(self):
+        """每interval秒校准一次"""
+        if time.time() - self.last_sync_tic > self.interval:
+            self.sync()
+
+    def now(self):
+        """当前的服务器时间 (秒)"""
+        return time.time() + self.offset
+
+
+class MinuteScheduler:
+    """分钟对齐的轮询调度
+
+    clock: `ServerClock`
+    offset: 分钟边界之后等待的秒数 (收线后交易所的数据就绪需要一点时间)
+    retry_delay/max_delay: 重试的初始/最大间隔 (秒)，每次翻倍
+    jitter: 重试间隔乘以[1 - jitter, 1 + jitter]内的随机系数，避免所有未取到的币种同时重试
+    """
+
+    def __init__(self, clock, offset=1.0, retry_delay=1.0, max_delay=15.0, jitter=0.5):
+        self.clock = clock
+        self.offset = offset
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retries = {}    # symbol -> (已重试次数, 下次重试的服务器时间)
+
+    def due(self, symbols, last_timestamps, now=None):
+        """下一根K线已收线、且不在重试退避中的币种
+
+        last_timestamps: {symbol: 最新K线的开盘时间 (毫秒)}
+        """
+
+        if now is None:
+            now = self.clock.now()
+        now_timestamp = now * 1000
+        symbols = [
+            symbol for symbol in symbols
+            if last_timestamps[symbol] + 2 * MINUTE_MS <= now_timestamp    # 下一根K线的收线时间为开盘时间+60秒
+        ]
+        return [symbol for symbol in symbols if symbol not in self.retries or self.retries[symbol][1] <= now]
+
+    def done(self, symbol):
+        """已取到新数据，清除重试状态"""
+        self.retries.pop(symbol, None)
+
+    def retry(self, symbol, now=None):
+        """未取到新数据，安排退避后重试"""
+
+        if now is None:
+            now = self.clock.now()
+        attempts = self.retries[symbol][0] if symbol in self.retries else 0
+        delay = min(self.retry_delay * 2 ** attempts, self.max_delay)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.retries[symbol] = (attempts + 1, now + delay)
+        metrics.registry.inc("monitor_fetch_retries_total")
+
+    def next_wakeup(self, now=None):
+        """下一个分钟边界+offset与最早的重试时间中较早的一个 (服务器时间，秒)"""
+
+        if now is None:
+            now = self.clock.now()
+        boundary = ((now - self.offset) // 60 + 1) * 60 + self.offset
+        return min([boundary] + [retry_tic for _, retry_tic in self.retries.values()])
+
+    def sleep(self):
+        """休眠到下一次唤醒"""
+
+        now = self.clock.now()
+        delay = self.next_wakeup(now) - now
+        if delay > 0:
+            time.sleep(delay)
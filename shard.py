@@ -0,0 +1,405 @@
+# 多进程分片监控：币种按哈希分配到多个工作进程，每个工作进程独立请求行情、写入自己币种的数据文件并执行监控规则，
+# 告警及最新价/7日均交易额通过队列汇总到主进程；主进程统一输出告警、重新排名 (下发监控范围) 并维护价格指数，
+# 某个工作进程持续落后时将其部分币种迁移到最空闲的工作进程
+#
+# python3 monitor.py --workers 4
+
+import os
+import time
+import zlib
+import queue
+import asyncio
+import multiprocessing
+import numpy as np
+
+import alerts
+import data_loader
+import metrics
+from engine import MonitorEngine
+from rules import RuleSet
+from scheduler import ServerClock, MinuteScheduler
+from universe import Universe
+
+
+def shard_of(symbol, n):
+    """稳定的哈希分片 (不受PYTHONHASHSEED影响)"""
+    return zlib.crc32(symbol.encode("utf-8")) % n
+
+
+class QueueDispatcher:
+    """工作进程中代替`alerts.AlertDispatcher`，将告警发送到主进程统一分发"""
+
+    def __init__(self, messages, worker):
+        self.messages = messages
+        self.worker = worker
+
+    def publish(self, alert):
+        self.messages.put(("alert", self.worker, alert.to_dict()))
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def load_engine(symbols, rules=None, dispatcher=None, engine=None):
+    """创建symbols的监控引擎，engine中已有的币种复制其窗口与提示状态，其余从数据文件读取
+
+    returns: (engine, last_timestamps)，数据不足7天的币种不包含在内
+    """
+
+    histories = {}
+    for coin in symbols:
+        if engine is not None and coin in engine.rows:
+            row = engine.rows[coin]
+            histories[coin] = (engine.window(engine.tics, [row])[0], engine.window(engine.prices, [row])[0], engine.window(engine.volumes, [row])[0])
+            continue
+        file = data_loader.get_data_file(coin)
+        if not os.path.exists(file):
+            continue
+        data = data_loader.Data(file)    # 与`monitor.create_engine`一致，取最后7天的数据，之后的缺口由轮询补齐
+        if len(data.prices) < data_loader.DAY * 7:
+            continue
+        histories[coin] = (data.tics[-data_loader.DAY * 7:], data.prices[-data_loader.DAY * 7:], data.volumes[-data_loader.DAY * 7:])
+
+    new = MonitorEngine(list(histories), rules=rules, dispatcher=dispatcher)
+    for coin, (tics, prices, volumes) in histories.items():
+        new.load(coin, tics, prices, volumes)
+        if engine is not None and coin in engine.rows:
+            row, new_row = engine.rows[coin], new.rows[coin]
+            new.active[new_row] = engine.active[row]
+            new.last_alarm[new_row] = engine.last_alarm[row]
+            new.last_alarm_tic[new_row] = engine.last_alarm_tic[row]
+    last_timestamps = {coin: int(tic) for coin, tic in zip(new.symbols, new.last(new.tics))}
+    return new, last_timestamps
+
+
+def worker(index, symbols, messages, commands, rules_file=None, api_url=None, weight_limit=1200, offset=1.0):
+    """工作进程：轮询symbols的行情并执行监控
+
+    commands: 主进程的指令 ("active", 监控范围), ("release", 币种), ("adopt", 币种), ("stop", None)
+    messages: 发往主进程的消息 ("alert", ...), ("status", ...), ("released", ...)
+    """
+
+    import monitor
+    from async_binance import AsyncBinanceAPI
+
+    data_loader.writer.close_handles()    # 不使用主进程打开的文件句柄
+    if api_url:
+        data_loader.instance.base_url = api_url
+    rules = RuleSet.load(rules_file) if rules_file else None
+    dispatcher = QueueDispatcher(messages, index)
+    engine, last_timestamps = load_engine(symbols, rules, dispatcher)
+    dropped = [coin for coin in symbols if coin not in engine.rows]
+    if dropped:    # 数据不足7天，由主进程移除
+        messages.put(("dropped", index, dropped))
+
+    loop = asyncio.new_event_loop()
+    client = AsyncBinanceAPI(base_url=api_url, weight_limit=weight_limit)
+    loop.run_until_complete(client.open())
+    clock = ServerClock(data_loader.instance.get_time)
+    scheduler = MinuteScheduler(clock, offset)
+    sweep = 0.0
+
+    try:
+        while True:
+            messages.put(("status", index, {
+                "symbols": engine.symbols,
+                "last_timestamps": [last_timestamps[coin] for coin in engine.symbols],
+                "prices": engine.last(engine.prices).tolist(),
+                "volumes": engine.moving_average("volume", "7d").tolist(),
+                "sweep": sweep,
+            }))
+
+            # 处理主进程的指令，直到下一次唤醒
+            while True:
+                now = clock.now()
+                try:
+                    command, args = commands.get(timeout=max(scheduler.next_wakeup(now) - now, 0.001))
+                except queue.Empty:
+                    break
+                if command == "stop":
+                    return
+                elif command == "active":
+                    engine.active[:] = [coin in args for coin in engine.symbols]
+                elif command == "release":
+                    data_loader.writer.flush()    # 迁入的工作进程从数据文件读取
+                    released = [coin for coin in args if coin in engine.rows]
+                    engine, last_timestamps = load_engine([coin for coin in engine.symbols if coin not in args], rules, dispatcher, engine)
+                    messages.put(("released", index, released))
+                elif command == "adopt":
+                    engine, last_timestamps = load_engine(engine.symbols + list(args), rules, dispatcher, engine)
+                    dropped = [coin for coin in args if coin not in engine.rows]
+                    if dropped:
+                        messages.put(("dropped", index, dropped))
+
+            clock.update()
+            symbols = scheduler.due(engine.symbols, last_timestamps)
+            if not symbols:
+                continue
+            start = time.time()
+            latest = loop.run_until_complete(client.get_latest_data_many(
+                {coin: last_timestamps[coin] + 1 for coin in symbols},
+            ))
+            now = clock.now()
+            now_timestamp = int(now * data_loader.TIMESTAMP_UNIT)
+            bars = {}
+            for coin in symbols:
+                latest_data = latest.get(coin)
+                if not isinstance(latest_data, list):
+                    latest_data = []
+                latest_data = [item for item in latest_data if int(item[6]) < now_timestamp]
+                if len(latest_data) == 0:
+                    scheduler.retry(coin, now)
+                    continue
+                scheduler.done(coin)
+                bars[coin] = latest_data
+            monitor.handle_bars(engine, bars, last_timestamps)
+            sweep = time.time() - start
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(client.close())
+        data_loader.writer.close()
+
+
+class ShardState:
+    """主进程汇总的各币种最新状态，提供`universe.Universe`所需的引擎接口 (symbols/rows/active/moving_average/last)"""
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.active = np.ones(len(self.symbols), dtype=bool)
+        self.prices = np.full(len(self.symbols), np.nan)    # 最新价格
+        self.volumes = np.full(len(self.symbols), np.nan)    # 7日均交易额
+        self.last_timestamps = np.zeros(len(self.symbols), dtype=np.int64)
+
+    def moving_average(self, series, interval):
+        if (series, interval) != ("volume", "7d"):
+            raise ValueError("unsupported moving average: %s %s" % (series, interval))
+        return self.volumes
+
+    def last(self, values):
+        return values
+
+    def remove(self, symbols):
+        """移除symbols (开始排名之前)"""
+
+        keep = [i for i, symbol in enumerate(self.symbols) if symbol not in symbols]
+        self.symbols = [self.symbols[i] for i in keep]
+        self.rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.active = self.active[keep]
+        self.prices = self.prices[keep]
+        self.volumes = self.volumes[keep]
+        self.last_timestamps = self.last_timestamps[keep]
+
+    def disable(self, symbols):
+        """清除symbols的状态，不再参与排名与价格指数 (开始排名之后，保持各币种所在行不变)"""
+
+        rows = [self.rows[symbol] for symbol in symbols if symbol in self.rows]
+        self.active[rows] = False
+        self.prices[rows] = np.nan
+        self.volumes[rows] = np.nan
+        self.last_timestamps[rows] = 0
+
+    def update(self, status):
+        """更新一个工作进程上报的状态，返回其币种所在行"""
+
+        rows = [self.rows[coin] for coin in status["symbols"]]
+        self.last_timestamps[rows] = status["last_timestamps"]
+        self.prices[rows] = status["prices"]
+        self.volumes[rows] = status["volumes"]
+        return rows
+
+
+class Coordinator:
+    """主进程：启动工作进程，分发告警，重新排名，维护价格指数，迁移落后的工作进程的币种
+
+    symbols: 所有候选币种
+    workers: 工作进程数
+    max_lag: 工作进程的最大数据延迟 (秒) 持续超过该值时迁移其1/4的币种
+    """
+
+    def __init__(
+        self,
+        symbols,
+        workers=4,
+        dispatcher=None,
+        rules_file=None,
+        api_url=None,
+        top=0,
+        index_size=100,
+        rank_interval=3600,
+        offset=1.0,
+        weight_limit=1200,
+        max_lag=30,
+        patience=3,
+        cooldown=300,
+    ):
+        self.workers = workers
+        self.dispatcher = dispatcher or alerts.AlertDispatcher([alerts.ConsoleSink(), alerts.SoundSink()])
+        self.worker_args = (rules_file, api_url, weight_limit // workers, offset)    # 所有工作进程共享IP的请求权重
+        self.top = top
+        self.index_size = index_size
+        self.rank_interval = rank_interval
+        self.max_lag = max_lag
+        self.patience = patience
+        self.cooldown = cooldown
+
+        self.state = ShardState(symbols)
+        self.assignment = {symbol: shard_of(symbol, workers) for symbol in self.state.symbols}
+        self.sweeps = np.zeros(workers)    # 各工作进程最近一次请求+执行监控的耗时
+        self.slow = np.zeros(workers, dtype=np.int64)    # 连续落后的次数
+        self.migrating = None    # 迁移中的 (源, 目标, 币种)
+        self.reported = set()    # 已上报过状态的工作进程
+        self.last_migrate_tic = time.time()
+        self.universe = None
+        self.active = None    # 已下发的监控范围
+        self.messages = multiprocessing.Queue()
+        self.commands = [multiprocessing.Queue() for _ in range(workers)]
+        self.processes = []
+
+    def start(self):
+        data_loader.writer.flush()    # 工作进程从数据文件读取
+        for i in range(self.workers):
+            symbols = [symbol for symbol, shard in self.assignment.items() if shard == i]
+            process = multiprocessing.Process(
+                target=worker,
+                args=(i, symbols, self.messages, self.commands[i]) + self.worker_args,
+                name="monitor-%d" % i,
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+        metrics.registry.gauge("shard_symbols", lambda: {
+            (("worker", i),): sum(1 for shard in self.assignment.values() if shard == i) for i in range(self.workers)
+        }, "各工作进程负责的币种数")
+        metrics.registry.gauge("shard_lag_seconds", lambda: {
+            (("worker", i),): round(lag, 3) for i, lag in enumerate(self.lags())
+        }, "各工作进程的最大数据延迟")
+        metrics.registry.gauge("shard_sweep_seconds", lambda: {
+            (("worker", i),): round(sweep, 3) for i, sweep in enumerate(self.sweeps)
+        }, "各工作进程最近一次请求+执行监控的耗时")
+
+    def stop(self):
+        for commands in self.commands:
+            commands.put(("stop", None))
+        for process in self.processes:
+            process.join(timeout=10)
+
+    def lags(self):
+        """各工作进程负责的币种中最大的数据延迟 (当前时间 - 下一根K线的收线时间，尚未收线为0)"""
+
+        now = time.time() * data_loader.TIMESTAMP_UNIT
+        lags = np.zeros(self.workers)
+        loaded = self.state.last_timestamps > 0
+        for symbol, shard in self.assignment.items():
+            row = self.state.rows[symbol]
+            if loaded[row]:
+                lag = (now - self.state.last_timestamps[row]) / data_loader.TIMESTAMP_UNIT - 120
+                lags[shard] = max(lags[shard], lag)
+        return lags
+
+    def handle(self, message):
+        kind, index, payload = message
+        if kind == "alert":
+            created = payload.pop("created")
+            alert = alerts.Alert(**payload)
+            alert.created = created
+            metrics.registry.inc("alerts_total", rule=alert.rule)
+            self.dispatcher.publish(alert)
+        elif kind == "status":
+            self.sweeps[index] = payload["sweep"]
+            self.reported.add(index)
+            rows = self.state.update(payload)
+            if self.universe is not None:
+                self.universe.on_prices(rows, self.state.prices[rows])
+        elif kind == "dropped":
+            self.drop(payload)
+        elif kind == "released":
+            source, target, symbols = self.migrating
+            self.drop([symbol for symbol in symbols if symbol not in payload])    # 源工作进程中已不存在
+            symbols = payload
+            for symbol in symbols:
+                self.assignment[symbol] = target
+            self.commands[target].put(("adopt", symbols))
+            if self.active is not None:
+                self.commands[target].put(("active", self.active))
+            print("%s个币种从工作进程%d迁移到%d" % (len(symbols), source, target))
+            self.migrating = None
+
+    def drop(self, symbols):
+        """移除工作进程未能载入的币种"""
+
+        if not symbols:
+            return
+        for symbol in symbols:
+            self.assignment.pop(symbol, None)
+        if self.universe is None:
+            self.state.remove(symbols)
+        else:
+            self.state.disable(symbols)
+        print("移除%d个数据不足的币种: %s" % (len(symbols), ", ".join(symbols)))
+
+    def rebalance(self):
+        """某个工作进程连续patience次落后超过max_lag秒时，将其1/4的币种迁移到延迟最小的工作进程"""
+
+        if self.migrating is not None or time.time() - self.last_migrate_tic < self.cooldown:
+            return
+        lags = self.lags()
+        self.slow = np.where(lags > self.max_lag, self.slow + 1, 0)
+        source = int(np.argmax(self.slow))
+        target = int(np.argmin(lags))
+        if self.slow[source] < self.patience or source == target or lags[target] > self.max_lag:
+            return
+        symbols = [symbol for symbol, shard in self.assignment.items() if shard == source]
+        symbols = symbols[:len(symbols) // 4]
+        if not symbols:
+            return
+        self.migrating = (source, target, symbols)
+        self.commands[source].put(("release", symbols))
+        self.slow[:] = 0
+        self.last_migrate_tic = time.time()
+        metrics.registry.inc("shard_migrations_total")
+
+    def update_active(self):
+        """下发变化的监控范围"""
+
+        active = {symbol for symbol, flag in zip(self.state.symbols, self.state.active) if flag}
+        if active == self.active:
+            return
+        self.active = active
+        for commands in self.commands:
+            commands.put(("active", active))
+
+    def run(self, periodic=()):
+        """启动工作进程，所有工作进程上报一次状态后开始排名，此后持续处理消息
+
+        periodic: 定期调用其update()的对象
+        """
+
+        self.start()
+        last_check_tic = time.time()
+        while True:
+            try:
+                self.handle(self.messages.get(timeout=1))
+            except queue.Empty:
+                pass
+
+            if self.universe is None:
+                if len(self.reported) < self.workers:
+                    continue
+                self.universe = Universe(self.state, self.top, self.index_size, self.rank_interval)
+                self.update_active()
+
+            if time.time() - last_check_tic < 10:
+                continue
+            last_check_tic = time.time()
+            self.universe.update()
+            self.universe.report()
+            self.update_active()
+            self.rebalance()
+            for item in periodic:
+                item.update()
@@ -0,0 +1,204 @@
+# 共享内存中的实时价量矩阵：监控进程将引擎的7日窗口 (各币种的时间戳/价格/交易额) 直接保存在命名共享内存中，
+# 同一台机器上的其他进程 (数据分析、notebook等) 可零拷贝地读取最新数据，无需重复读取和解析数据文件
+#
+# 使用版本号 (seqlock) 保证一致性：写入前后各加1，读取前后版本号相同且为偶数时读到的数据完整，否则重试；读取方不加锁
+#
+#   import shared_candles
+#   reader = shared_candles.SharedCandles.attach()
+#   tics, prices, volumes = reader.window("BTCUSDT", 60)    # 最近60分钟 (拷贝)
+#   means = reader.read(lambda view: view.prices.mean(axis=1))    # 直接在共享内存上计算 (零拷贝)
+
+import os
+import json
+import time
+import contextlib
+import numpy as np
+from multiprocessing import shared_memory
+
+
+NAME = "binance_monitor"
+MAGIC = 0x4B4C494E45424E42
+HEADER = 6    # 头部int64个数: magic, 版本号, 币种数, 每个币种的分钟数, 币种列表的字节数, 创建者进程号
+
+_created = set()    # 本进程创建 (由本进程的resource_tracker管理) 的共享内存名称
+
+
+def _open(name):
+    """连接已有的共享内存，不交给resource_tracker管理 (本进程创建的除外)"""
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:    # Python < 3.13: 避免退出时resource_tracker删除他人创建的共享内存
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        if name not in _created:    # 本进程创建的共享内存已注册，由创建者unlink时注销
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _owner(name):
+    """已有共享内存的创建者进程号，无法识别时返回0"""
+
+    shm = _open(name)
+    pid = 0
+    if shm.size >= HEADER * 8:
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        if header[0] == MAGIC:
+            pid = int(header[5])
+        del header
+    shm.close()
+    return pid
+
+
+def _alive(pid):
+    if os.name == "nt":    # Windows的命名共享内存随最后一个句柄关闭而释放，仍存在即仍在使用
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:    # 其他用户的进程
+        return True
+    return True
+
+
+class SharedCandles:
+    """共享内存中的价量矩阵
+
+    布局: 头部 | 币种列表 (JSON，按8字节对齐) | heads (n) | tics (n x capacity) | prices | volumes
+    各行为环形窗口，heads为每行下一个写入位置，与`engine.MonitorEngine`一致
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner    # 创建者负责释放共享内存
+
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != MAGIC:
+            raise ValueError("invalid shared memory block: %s" % shm.name)
+        n, capacity, size = int(header[2]), int(header[3]), int(header[4])
+        offset = HEADER * 8
+        self.symbols = json.loads(bytes(shm.buf[offset:offset + size]).decode("utf-8"))
+        self.rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.capacity = capacity
+        offset += -(-size // 8) * 8
+
+        self.header = header
+        self.heads = np.ndarray((n,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += n * 8
+        self.tics = np.ndarray((n, capacity), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += n * capacity * 8
+        self.prices = np.ndarray((n, capacity), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += n * capacity * 8
+        self.volumes = np.ndarray((n, capacity), dtype=np.float64, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, symbols, capacity, name=NAME):
+        """创建共享内存
+
+        同名的共享内存的创建者已退出 (上次运行未正常退出) 时替换，仍在运行时抛出FileExistsError
+        """
+
+        names = json.dumps(list(symbols)).encode("utf-8")
+        n = len(symbols)
+        size = HEADER * 8 + -(-len(names) // 8) * 8 + n * 8 + n * capacity * 8 * 3
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            pid = _owner(name)
+            if pid and _alive(pid):
+                raise FileExistsError("shared memory %s is in use by process %d" % (name, pid))
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        header[:] = [0, 0, n, capacity, len(names), os.getpid()]
+        shm.buf[HEADER * 8:HEADER * 8 + len(names)] = names
+        header[0] = MAGIC
+        del header
+        _created.add(name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=NAME):
+        """连接已有的共享内存 (只读使用)"""
+
+        return cls(_open(name))
+
+    @property
+    def version(self):
+        """版本号，每次写入加2，奇数表示正在写入"""
+        return int(self.header[1])
+
+    @contextlib.contextmanager
+    def writing(self):
+        """写入期间版本号为奇数"""
+        self.header[1] += 1
+        try:
+            yield
+        finally:
+            self.header[1] += 1
+
+    def read(self, fn, retries=100):
+        """在一致的数据上执行fn(self)并返回其结果，写入期间读到的结果会被丢弃并重试
+
+        fn内可直接使用tics/prices/volumes/heads (共享内存的视图，零拷贝)，返回值需为拷贝 (如计算结果)
+        """
+
+        for _ in range(retries):
+            version = self.version
+            if version % 2 == 0:
+                result = fn(self)
+                if self.version == version:
+                    return result
+            time.sleep(0.001)
+        raise TimeoutError("shared memory %s is busy" % self.shm.name)
+
+    def window(self, symbol, size=None):
+        """symbol按时间顺序的最近size (默认全部) 分钟的数据
+
+        returns: (tics, prices, volumes)，拷贝
+        """
+
+        row = self.rows[symbol]
+        size = size or self.capacity
+
+        def fn(view):
+            columns = (view.heads[row] - size + np.arange(size)) % view.capacity
+            return view.tics[row, columns], view.prices[row, columns], view.volumes[row, columns]
+        return self.read(fn)
+
+    def snapshot(self):
+        """所有币种按时间顺序的完整窗口
+
+        returns: (tics, prices, volumes)，均为 币种 x 分钟 的拷贝
+        """
+
+        def fn(view):
+            columns = (view.heads[:, None] + np.arange(view.capacity)) % view.capacity
+            rows = np.arange(len(view.symbols))[:, None]
+            return view.tics[rows, columns], view.prices[rows, columns], view.volumes[rows, columns]
+        return self.read(fn)
+
+    def wait(self, version, timeout=None, interval=0.1):
+        """等待版本号超过version (即有新数据写入)，超时返回False"""
+
+        start = time.time()
+        while self.version <= version or self.version % 2:
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self):
+        for name in ("header", "heads", "tics", "prices", "volumes"):
+            setattr(self, name, None)    # 释放对共享内存的引用
+        try:
+            self.shm.close()
+        except BufferError:    # 仍有数组 (如引擎的价量矩阵) 引用共享内存，随进程退出释放
+            pass
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
@@ -0,0 +1,270 @@
+# 基于WebSocket的K线推送：订阅多个币种的1分钟K线，收线后批量回调；断线自动重连，缺失的K线通过REST补齐
+#
+# 另提供本地回放服务 (ReplayServer)，可回放录制的推送消息或历史数据，便于离线测试
+
+import json
+import time
+import random
+import asyncio
+import numpy as np
+import websockets
+
+import candle_store
+import metrics
+
+
+STREAM_URL = "wss://stream.binance.com:9443/stream"
+MINUTE_MS = 60 * 1000
+
+
+def kline_to_row(k):
+    """将推送消息中的K线转换为`/klines`接口的返回格式"""
+    return [k["t"], k["o"], k["h"], k["l"], k["c"], k["v"], k["T"], k["q"], k["n"], k["V"], k["Q"], k.get("B", "0")]
+
+
+def row_to_message(symbol, row, closed=True, interval="1m"):
+    """将`/klines`格式的K线转换为组合流推送消息 (ReplayServer使用)"""
+
+    t, o, h, l, c, v, close_time, q, n, taker_v, taker_q = row[:11]
+    return {
+        "stream": "%s@kline_%s" % (symbol.lower(), interval),
+        "data": {
+            "e": "kline",
+            "E": int(close_time) + 1,
+            "s": symbol,
+            "k": {
+                "t": int(t), "T": int(close_time), "s": symbol, "i": interval,
+                "o": str(o), "c": str(c), "h": str(h), "l": str(l), "v": str(v),
+                "n": int(n), "x": closed, "q": str(q), "V": str(taker_v), "Q": str(taker_q), "B": "0",
+            },
+        },
+    }
+
+
+class KlineStream:
+    """订阅组合K线推送，收线 (k["x"]为True) 后回调
+
+    symbols: 币种列表
+    on_bars: 回调函数，参数为 {symbol: [kline, ...]}，同一分钟内收到的K线合并为一次回调
+    last_timestamps: {symbol: 最后一条已处理K线的开盘时间}，用于发现并补齐缺口
+    client: `async_binance.AsyncBinanceAPI`实例，用于通过REST补齐缺口 (None则不补齐)
+    """
+
+    SUBSCRIBE_CHUNK = 100    # 每条订阅消息包含的stream数量
+
+    def __init__(self, symbols, on_bars, last_timestamps, client=None, url=STREAM_URL, batch_delay=0.2, record=None, verbosity=1):
+        self.symbols = list(symbols)
+        self.on_bars = on_bars
+        self.last_timestamps = dict(last_timestamps)
+        self.client = client
+        self.url = url
+        self.batch_delay = batch_delay    # 收到首条收线消息后等待同批次其他币种的时间 (秒)
+        self.record = record    # 录制推送消息的文件路径 (每行为`接收时间\t消息`)，可用于ReplayServer回放
+        self.verbosity = verbosity
+
+        self.pending = {}    # 待回调的K线
+        self.flush_task = None
+        self.gaps = {}    # 待补齐的币种 -> 缺口前最后一条K线的开盘时间
+        self.waiting = {}    # 补齐期间收到的K线，补齐后接在缺失的K线之后
+        self.fill_task = None
+        self.reconnects = 0
+
+    async def run(self):
+        """持续接收推送，断线后以指数退避重连"""
+
+        delay = 1
+        while True:
+            try:
+                await self._consume()
+                delay = 1
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                if self.verbosity:
+                    print("FAIL: websocket disconnected (%r), reconnect in %ds" % (e, delay))
+            self.reconnects += 1
+            metrics.registry.inc("stream_reconnects_total")
+            await asyncio.sleep(delay * (1 + random.random() / 2))
+            delay = min(delay * 2, 60)
+
+    async def _consume(self):
+        record = open(self.record, "a", encoding="utf-8") if self.record else None
+        try:
+            async with websockets.connect(self.url, ping_interval=20, max_size=2 ** 22) as ws:
+                streams = ["%s@kline_1m" % symbol.lower() for symbol in self.symbols]
+                for i in range(0, len(streams), self.SUBSCRIBE_CHUNK):
+                    await ws.send(json.dumps({
+                        "method": "SUBSCRIBE",
+                        "params": streams[i:i + self.SUBSCRIBE_CHUNK],
+                        "id": i // self.SUBSCRIBE_CHUNK + 1,
+                    }))
+                if self.verbosity:
+                    print("已订阅%d个币种的K线推送" % len(streams))
+
+                async for message in ws:
+                    if record:
+                        record.write("%s\t%s\n" % (time.time(), message))
+                    message = json.loads(message)
+                    data = message.get("data") if isinstance(message, dict) else None
+                    if not data or data.get("e") != "kline" or not data["k"]["x"]:    # 订阅回执或未收线
+                        continue
+                    self._on_closed(data["s"], kline_to_row(data["k"]))
+        finally:
+            if record:
+                record.close()
+
+    def _on_closed(self, symbol, row):
+        """处理一条收线K线，有缺口的币种交给`_fill`在接收循环之外通过REST补齐"""
+
+        last = self.last_timestamps.get(symbol)
+        if last is not None and row[0] <= last:    # 重复推送
+            return
+        self.last_timestamps[symbol] = row[0]
+        if symbol in self.waiting:    # 正在补齐，排在补齐的K线之后
+            self.waiting[symbol].append(row)
+            return
+        if last is not None and row[0] > last + MINUTE_MS and self.client is not None:
+            self.gaps[symbol] = last
+            self.waiting[symbol] = [row]
+            if self.fill_task is None:
+                self.fill_task = asyncio.ensure_future(self._fill())
+            return
+        self._add({symbol: [row]})
+
+    async def _fill(self):
+        """并发补齐各币种的缺口 (如重连后的所有币种)，补齐期间继续接收推送"""
+
+        delay = self.batch_delay
+        while self.gaps:
+            await asyncio.sleep(delay)    # 等待同批次其他币种的缺口
+            gaps, self.gaps = self.gaps, {}
+            results = await self.client.get_latest_data_many({symbol: last + 1 for symbol, last in gaps.items()})
+            bars = {}
+            failed = []
+            for symbol, last in gaps.items():
+                if not isinstance(results[symbol], list):    # 请求失败，保留缺口和收到的K线，稍后重试
+                    self.gaps[symbol] = last
+                    failed.append(symbol)
+                    continue
+                rows = self.waiting.pop(symbol)
+                missing = [item for item in results[symbol] if last < int(item[0]) < rows[0][0]]
+                if self.verbosity:
+                    print("%s 补齐%d条缺失K线" % (symbol, len(missing)))
+                bars[symbol] = missing + rows
+            if bars:
+                self._add(bars)
+            if failed:
+                delay = min(delay * 2, 60)
+                if self.verbosity:
+                    print("FAIL: %d个币种补齐缺失K线失败，%.1f秒后重试" % (len(failed), delay))
+            else:
+                delay = self.batch_delay
+        self.fill_task = None
+
+    def _add(self, bars):
+        for symbol, rows in bars.items():
+            self.pending.setdefault(symbol, []).extend(rows)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        await asyncio.sleep(self.batch_delay)
+        bars, self.pending, self.flush_task = self.pending, {}, None
+        self.on_bars(bars)
+
+
+class ReplayServer:
+    """本地WebSocket回放服务，模拟币安组合流
+
+    messages: [(相对时间秒, 消息字符串), ...]，按订阅的stream过滤后依次推送
+    speed: 回放倍速 (0表示不等待，尽快推送)
+    drop_after: 每个连接推送多少条消息后主动断开 (用于测试重连)
+    """
+
+    def __init__(self, messages, host="127.0.0.1", port=18765, speed=1.0, drop_after=None):
+        self.messages = messages
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.drop_after = drop_after
+        self.cursor = 0    # 断线重连后从上次位置继续回放
+        self.server = None
+
+    @property
+    def url(self):
+        return "ws://%s:%d/stream" % (self.host, self.port)
+
+    @classmethod
+    def from_record(cls, file, **kwargs):
+        """读取`KlineStream(record=...)`录制的消息"""
+
+        messages = []
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                tic, message = line.rstrip("\n").split("\t", 1)
+                messages.append((float(tic), message))
+        if messages:
+            start = messages[0][0]
+            messages = [(tic - start, message) for tic, message in messages]
+        return cls(messages, **kwargs)
+
+    @classmethod
+    def from_store(cls, files, start=None, end=None, **kwargs):
+        """由历史K线文件生成推送消息，每分钟一批
+
+        files: {symbol: 二进制K线文件路径}
+        """
+
+        by_tic = {}
+        for symbol, file in files.items():
+            records = candle_store.load(file)
+            lo = 0 if start is None else np.searchsorted(records["open_time"], start)
+            hi = len(records) if end is None else np.searchsorted(records["open_time"], end, side="right")
+            for row in records[lo:hi].tolist():
+                by_tic.setdefault(row[0], []).append(json.dumps(row_to_message(symbol, row)))
+        messages = []
+        if by_tic:
+            first = min(by_tic)
+            for tic in sorted(by_tic):
+                messages += [((tic - first) / 1000, message) for message in by_tic[tic]]
+        return cls(messages, **kwargs)
+
+    async def _handler(self, ws):
+        streams = set()
+        subscribed = asyncio.Event()
+        sent = 0
+        offset = self.messages[self.cursor][0] if self.cursor < len(self.messages) else 0
+        start = time.time() - offset / self.speed if self.speed else 0
+
+        async def receive():
+            async for message in ws:
+                request = json.loads(message)
+                if request.get("method") == "SUBSCRIBE":
+                    streams.update(request["params"])
+                    subscribed.set()
+                    await ws.send(json.dumps({"result": None, "id": request.get("id")}))
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            await asyncio.wait_for(subscribed.wait(), timeout=10)
+            await asyncio.sleep(0.1)    # 等待同一连接的其他订阅消息
+            while self.cursor < len(self.messages):
+                tic, message = self.messages[self.cursor]
+                if self.speed:
+                    await asyncio.sleep(max(0, start + tic / self.speed - time.time()))
+                self.cursor += 1
+                if json.loads(message).get("stream") not in streams:
+                    continue
+                await ws.send(message)
+                sent += 1
+                if self.drop_after and sent >= self.drop_after:
+                    break
+            await ws.close()
+        finally:
+            receiver.cancel()
+
+    async def start(self):
+        self.server = await websockets.serve(self._handler, self.host, self.port)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
@@ -0,0 +1,47 @@
+# 由全市场行情快照构造临时K线：每分钟一次不指定币种的`/ticker/24hr`请求即可得到所有币种的最新价与24小时成交额，
+# 代替逐个币种请求`/klines`；临时K线只用于更新引擎和筛选可能触发规则的币种，告警及数据文件以`/klines`的已收线K线为准
+
+import numpy as np
+
+import data_loader
+
+
+MINUTE_MS = 60 * 1000
+
+
+class TickerBars:
+    """由相邻两分钟的24小时行情快照构造各币种刚收线的一分钟的临时K线
+
+    收盘价取快照中的最新价；
+    交易额 = 两次快照的24小时成交额之差 + 滑出24小时窗口的那一分钟的交易额 (取自引擎中的历史)
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.quote_volumes = np.full(len(engine.symbols), np.nan)    # 上一次快照的24小时成交额
+        self.snapshot_tic = None    # 上一次快照对应的分钟 (开盘时间)
+
+    def build(self, tickers, tic):
+        """tickers: `/ticker/24hr`返回的所有币种的行情
+        tic: 刚收线的分钟的开盘时间 (毫秒)
+        returns: (rows, prices, volumes)，只包含引擎数据连续到上一分钟、且有上一分钟快照的币种
+        """
+
+        engine = self.engine
+        items = [item for item in tickers if item["symbol"] in engine.rows]
+        rows = np.array([engine.rows[item["symbol"]] for item in items], dtype=np.int64)
+        prices = np.array([float(item["lastPrice"]) for item in items])
+        quote_volumes = np.array([float(item["quoteVolume"]) for item in items])
+
+        if self.snapshot_tic == tic - MINUTE_MS:
+            previous = self.quote_volumes[rows]
+        else:
+            previous = np.full(len(rows), np.nan)
+        self.quote_volumes[:] = np.nan
+        self.quote_volumes[rows] = quote_volumes
+        self.snapshot_tic = tic
+
+        dropped = engine.last(engine.volumes, rows, data_loader.DAY)
+        volumes = np.maximum(quote_volumes - previous + dropped, 0)
+        valid = ~np.isnan(volumes) & (engine.last(engine.tics, rows) == tic - MINUTE_MS)
+        return rows[valid], prices[valid], volumes[valid]
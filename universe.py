@@ -0,0 +1,142 @@
+# 监控范围管理：按7日滑动平均交易额定期重新排名，动态调整执行监控规则的头部币种及价格指数的成分币种
+#
+# 引擎保存所有币种的数据 (排名需要)，但只对排名前top的币种执行监控规则；
+# 价格指数为等权链式指数，成分币种变化时以当前指数值为基准重新挂钩，每分钟只按有新数据的成分币种增量更新
+
+import time
+import numpy as np
+
+import utils
+
+
+class ChainIndex:
+    """等权链式价格指数
+
+    value = level * mean(price / base)，level为上次成分调整时的指数值，base为成分币种在调整时的价格；
+    成分不变时只维护 sum(price / base)，每次更新的复杂度与有新价格的成分币种数成正比
+    """
+
+    def __init__(self, n):
+        self.level = 1.0    # 上次成分调整时的指数值
+        self.members = np.zeros(0, dtype=np.int64)    # 成分币种所在行
+        self.is_member = np.zeros(n, dtype=bool)
+        self.base = np.ones(n)    # 成分币种的基准价格
+        self.prices = np.zeros(n)    # 成分币种的最新价格
+        self.total = 0.0    # sum(prices / base)
+
+    def value(self):
+        if len(self.members) == 0:
+            return self.level
+        return self.level * self.total / len(self.members)
+
+    def update(self, rows, prices):
+        """rows的最新价格，非成分币种忽略"""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        mask = self.is_member[rows]
+        rows, prices = rows[mask], prices[mask]
+        self.total += ((prices - self.prices[rows]) / self.base[rows]).sum()
+        self.prices[rows] = prices
+
+    def relink(self, members, prices):
+        """调整成分币种，以当前指数值为新的基准 (指数值不因成分变化而跳变)
+
+        prices: 所有行的最新价格
+        """
+
+        self.level = self.value()
+        self.members = np.asarray(members, dtype=np.int64)
+        self.is_member[:] = False
+        self.is_member[self.members] = True
+        self.base[self.members] = prices[self.members]
+        self.prices[self.members] = prices[self.members]
+        self.total = float(len(self.members))    # 重新求和，同时消除增量更新的累积误差
+
+
+class Universe:
+    """监控范围管理
+
+    engine: `MonitorEngine`，包含所有候选币种
+    top: 执行监控规则的头部币种数 (0为全部)
+    index_size: 价格指数的成分币种数
+    interval: 重新排名的间隔 (秒)
+    """
+
+    def __init__(self, engine, top=0, index_size=100, interval=3600, verbosity=1):
+        self.engine = engine
+        self.top = top
+        self.index_size = index_size
+        self.interval = interval
+        self.verbosity = verbosity
+        self.index = ChainIndex(len(engine.symbols))
+        self.ranks = np.arange(len(engine.symbols))    # 按7日均交易额降序排列的行
+        self.last_rank_tic = -1
+        self.last_report_tic = -1
+        self.rerank()
+
+    def rank(self, k):
+        """7日均交易额前k的行 (降序)，只对前k个排序；没有数据的行不参与排名"""
+
+        volumes = self.engine.moving_average("volume", "7d")
+        valid = np.flatnonzero(np.isfinite(volumes))
+        k = min(k, len(valid))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = valid[np.argpartition(-volumes[valid], k - 1)[:k]]
+        return top[np.argsort(-volumes[top], kind="stable")]
+
+    def rerank(self):
+        """重新排名，调整监控范围及价格指数成分"""
+
+        n = len(self.engine.symbols)
+        ranks = self.rank(max(self.top or n, self.index_size))
+        active = np.zeros(n, dtype=bool)
+        active[ranks[:self.top] if self.top else ranks] = True
+        members = np.sort(ranks[:self.index_size])
+
+        if self.last_rank_tic > 0 and self.verbosity:
+            promoted = np.flatnonzero(active & ~self.engine.active)
+            demoted = np.flatnonzero(~active & self.engine.active)
+            if len(promoted) or len(demoted):
+                print("%s --- 调整监控范围, 新增: %s, 移除: %s" % (
+                    utils.tic2time(time.time()),
+                    ", ".join(self.engine.symbols[row] for row in promoted) or "无",
+                    ", ".join(self.engine.symbols[row] for row in demoted) or "无",
+                ))
+        self.engine.active[:] = active
+        self.ranks = ranks
+
+        if not np.array_equal(members, self.index.members):
+            self.index.relink(members, self.engine.last(self.engine.prices))
+        self.last_rank_tic = time.time()
+
+    def update(self):
+        """每interval秒重新排名"""
+        if time.time() - self.last_rank_tic > self.interval:
+            self.rerank()
+
+    def on_bars(self, bars):
+        """用新K线的收盘价增量更新价格指数
+
+        bars: {symbol: [kline, ...]}
+        """
+
+        rows = [self.engine.rows[symbol] for symbol in bars]
+        prices = [float(items[-1][4]) for items in bars.values()]
+        self.on_prices(rows, prices)
+
+    def on_prices(self, rows, prices):
+        """用rows的最新价格增量更新价格指数"""
+        self.index.update(rows, prices)
+
+    def report(self, interval=600):
+        """每interval秒打印一次价格指数"""
+
+        if time.time() - self.last_report_tic <= interval:
+            return
+        print("%s --- 价格指数, %.3f" % (
+            utils.tic2time(time.time()),
+            self.index.value(),
+        ))
+        self.last_report_tic = time.time()